@@ -1,63 +1,18 @@
-import itertools
-import json
-import math
-import os
-import random
-import statistics
 from datetime import datetime
 from io import BytesIO
 from zoneinfo import ZoneInfo
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import streamlit as st
-import trueskill
-from google.cloud import storage
-from google.oauth2 import service_account
-from PIL import Image, ImageOps
-
-
-def win_probability(team1, team2, env=None):
-    env = env if env else trueskill.global_env()
-    delta_mu = sum(r.mu for r in team1) - sum(r.mu for r in team2)
-    sum_sigma = sum(r.sigma**2 for r in itertools.chain(team1, team2))
-    size = len(team1) + len(team2)
-    denom = math.sqrt(size * (env.beta * env.beta) + sum_sigma)
-    return env.cdf(delta_mu / denom)
-
-
-def get_blobs(bucket_name, client):
-    blobs = client.list_blobs(bucket_name)
-    return blobs
-
-
-def read_file(bucket_name, file_path, client):
-    bucket = client.bucket(bucket_name)
-    content = bucket.blob(file_path).download_as_bytes()
-    return content
-
-
-def get_dataframe(_blobs, bucket_name, _client):
-    df_list = []
-    for blob in _blobs:
-        file_path = blob.name
-        if file_path == "players_name.json":
-            content = read_file(bucket_name, file_path, _client)
-            name_dict = json.loads(content)
-        elif file_path == "position_priority.json":
-            content = read_file(bucket_name, file_path, _client)
-            position_priority = json.loads(content)
-        else:
-            if os.path.isfile(f"csv/{file_path}"):
-                df = pd.read_csv(f"csv/{file_path}")
-            else:
-                content = read_file(bucket_name, file_path, _client)
-                df = pd.read_csv(BytesIO(content))
-                df.to_csv(f"csv/{file_path}")
-            df["cs"] = df["minionsKilled"] + df["neutralMinionsKilled"]
-            df_list.append(df)
-    return df_list, name_dict, position_priority
 
+from teambalancer.feed import open_feed
+from teambalancer.pipeline import lobby_proposals, team_proposals
+from teambalancer.rating import minmax_indices, win_probability
+from teambalancer.snapshot import get_snapshot
+from teambalancer.storage import make_client
+from teambalancer.thumbnails import ImageStore
+from teambalancer.timing import span, timings
 
 st.set_page_config(
     page_title="PlinCustom",
@@ -67,283 +22,15 @@ st.set_page_config(
 )
 
 
-def get_all_record():
-    st.session_state.env = trueskill.TrueSkill(draw_probability=0.0)
-    st.session_state.env.make_as_global()
-    st.session_state.rate_dict = {}
-    st.session_state.df_player_dict = {}
-    st.session_state.df_champion_dict = {}
-    st.session_state.df_set_dict = {}
-    st.session_state.df_all_champion_dict = {}
-    st.session_state.df_all_set_dict = {}
-    st.session_state.df_all_dict = {}
-    st.session_state.df_list = []
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    client = storage.Client(credentials=credentials)
-
-    bucket_name = "custom-match-history"
-    blobs = get_blobs(bucket_name, client)
-
-    match_dict = dict(
-        match_count=[0, 0, 0, 0, 0, 0],
-        win_count=[0, 0, 0, 0, 0, 0],
-        win_rate=[0, 0, 0, 0, 0, 0],
-        kill=[0, 0, 0, 0, 0, 0],
-        death=[0, 0, 0, 0, 0, 0],
-        assist=[0, 0, 0, 0, 0, 0],
-        kda=[0, 0, 0, 0, 0, 0],
-        cs=[0, 0, 0, 0, 0, 0],
-        gold=[0, 0, 0, 0, 0, 0],
-        c_ward=[0, 0, 0, 0, 0, 0],
-        rating=[None, None, None, None, None, None],
-        tier=[None, None, None, None, None, None],
-    )
-    position_dict = {
-        "TOP": "TOP",
-        "JUNGLE": "JNG",
-        "MIDDLE": "MID",
-        "BOTTOM": "BOT",
-        "UTILITY": "SUP",
-    }
-    position_idx = ["ALL", "TOP", "JNG", "MID", "BOT", "SUP"]
-    df_personal = pd.DataFrame(data=match_dict, index=position_idx)
-    (
-        st.session_state.df_list,
-        name_dict,
-        st.session_state.position_priority,
-    ) = get_dataframe(blobs, bucket_name, client)
-    for df in st.session_state.df_list:
-        team1 = {}
-        team2 = {}
-        team1_p = {}
-        team1_p2 = {}
-        team2_p = {}
-        team2_p2 = {}
-        for data in df.itertuples():
-            if data.player in name_dict:
-                player_name = name_dict[data.player]
-            else:
-                player_name = data.player
-            if player_name not in st.session_state.df_player_dict:
-                st.session_state.df_player_dict[player_name] = df_personal.copy()
-                st.session_state.rate_dict.update(
-                    {
-                        player_name: {
-                            idx: [st.session_state.env.create_rating()]
-                            for idx in position_idx
-                        }
-                    }
-                )
-            if data.team == 100:
-                team1[player_name] = st.session_state.rate_dict[player_name]["ALL"][0]
-                team1_p[player_name] = st.session_state.rate_dict[player_name][
-                    position_dict[data.individualPosition]
-                ][0]
-                team1_p2[player_name] = position_dict[data.individualPosition]
-            else:
-                team2[player_name] = st.session_state.rate_dict[player_name]["ALL"][0]
-                team2_p[player_name] = st.session_state.rate_dict[player_name][
-                    position_dict[data.individualPosition]
-                ][0]
-                team2_p2[player_name] = position_dict[data.individualPosition]
-
-        win_team = (data.win == "Win" and data.team == 100) or (
-            data.win != "Win" and data.team != 100
-        )
-        team1, team2, = st.session_state.env.rate(
-            (
-                team1,
-                team2,
-            ),
-            ranks=(
-                1 - win_team,
-                0 + win_team,
-            ),
-        )
-        team1_p, team2_p, = st.session_state.env.rate(
-            (
-                team1_p,
-                team2_p,
-            ),
-            ranks=(
-                1 - win_team,
-                0 + win_team,
-            ),
-        )
-        for r_key in team1.keys():
-            st.session_state.rate_dict[r_key]["ALL"].insert(0, team1[r_key])
-        for r_key in team2.keys():
-            st.session_state.rate_dict[r_key]["ALL"].insert(0, team2[r_key])
-        for r_key in team1_p.keys():
-            st.session_state.rate_dict[r_key][team1_p2[r_key]].insert(0, team1_p[r_key])
-        for r_key in team2_p.keys():
-            st.session_state.rate_dict[r_key][team2_p2[r_key]].insert(0, team2_p[r_key])
-
-        for data in df.itertuples():
-            if data.player in name_dict:
-                player_name = name_dict[data.player]
-            else:
-                player_name = data.player
-            champion_name = data.skin
-            if champion_name not in st.session_state.df_champion_dict:
-                st.session_state.df_champion_dict[champion_name] = df_personal.copy()
-            if (player_name, champion_name) not in st.session_state.df_set_dict:
-                st.session_state.df_set_dict[
-                    (player_name, champion_name)
-                ] = df_personal.copy()
-
-            for position in ("ALL", position_dict[data.individualPosition]):
-                for df_type in (
-                    st.session_state.df_player_dict[player_name],
-                    st.session_state.df_champion_dict[champion_name],
-                    st.session_state.df_set_dict[(player_name, champion_name)],
-                ):
-                    # 全データ集計
-                    df_type.at[position, "match_count"] += 1
-                    df_type.at[position, "win_count"] += 1 if data.win == "Win" else 0
-                    df_type.at[position, "kill"] += data.championsKilled
-                    df_type.at[position, "death"] += data.numDeaths
-                    df_type.at[position, "assist"] += data.assists
-                    df_type.at[position, "cs"] += data.cs
-                    df_type.at[position, "gold"] += data.goldEarned
-                    df_type.at[position, "c_ward"] += data.visionWardsBoughtInGame
-                st.session_state.df_player_dict[player_name].at[
-                    position, "rating"
-                ] = st.session_state.rate_dict[player_name][position][0].mu
-                rating = st.session_state.df_player_dict[player_name].at[
-                    position, "rating"
-                ]
-                tier = ""
-                if rating > 55.44:
-                    tier = "Challenger"
-                elif rating > 52.72:
-                    tier = "Grandmaster"
-                elif rating > 48.93:
-                    tier = "Master"
-                elif rating > 46.50:
-                    tier = "Diamond1"
-                elif rating > 44.77:
-                    tier = "Diamond2"
-                elif rating > 43.72:
-                    tier = "Diamond3"
-                elif rating > 42.30:
-                    tier = "Diamond4"
-                elif rating > 40.11:
-                    tier = "Platinum1"
-                elif rating > 38.79:
-                    tier = "Platinum2"
-                elif rating > 37.43:
-                    tier = "Platinum3"
-                elif rating > 34.88:
-                    tier = "Platinum4"
-                elif rating > 33.64:
-                    tier = "Gold1"
-                elif rating > 32.17:
-                    tier = "Gold2"
-                elif rating > 30.75:
-                    tier = "Gold3"
-                elif rating > 28.10:
-                    tier = "Gold4"
-                elif rating > 26.60:
-                    tier = "Silver1"
-                elif rating > 24.86:
-                    tier = "Silver2"
-                elif rating > 23.32:
-                    tier = "Silver3"
-                elif rating > 20.87:
-                    tier = "Silver4"
-                elif rating > 19.01:
-                    tier = "Bronze1"
-                elif rating > 16.95:
-                    tier = "Bronze2"
-                elif rating > 14.96:
-                    tier = "Bronze3"
-                elif rating > 11.76:
-                    tier = "Bronze4"
-                elif rating > 9.69:
-                    tier = "Iron1"
-                elif rating > 7.90:
-                    tier = "Iron2"
-                elif rating > 6.68:
-                    tier = "Iron3"
-                elif rating > 5.78:
-                    tier = "Iron4"
-                else:
-                    tier = "Unrank"
-                st.session_state.df_player_dict[player_name].at[position, "tier"] = tier
-
-    # データ正規化
-    for dict_type in (
-        st.session_state.df_player_dict,
-        st.session_state.df_champion_dict,
-        st.session_state.df_set_dict,
-    ):
-        for dict_key in dict_type.keys():
-            dict_type[dict_key]["win_rate"] = (
-                dict_type[dict_key]["win_count"] / dict_type[dict_key]["match_count"]
-            )
-            dict_type[dict_key]["kill"] /= dict_type[dict_key]["match_count"]
-            dict_type[dict_key]["death"] /= dict_type[dict_key]["match_count"]
-            dict_type[dict_key]["assist"] /= dict_type[dict_key]["match_count"]
-            dict_type[dict_key]["kda"] = (
-                dict_type[dict_key]["kill"] + dict_type[dict_key]["assist"]
-            ) / [x if x != 0 else 1 for x in dict_type[dict_key]["death"]]
-            dict_type[dict_key]["cs"] /= dict_type[dict_key]["match_count"]
-            dict_type[dict_key]["gold"] /= dict_type[dict_key]["match_count"]
-            dict_type[dict_key]["c_ward"] /= dict_type[dict_key]["match_count"]
-
-    # 全体集計用データ作成
-    df_all_player = pd.DataFrame(
-        index=[],
-        columns=st.session_state.df_player_dict[
-            next(iter(st.session_state.df_player_dict))
-        ].columns,
-    )
-    for player in st.session_state.df_player_dict.keys():
-        for position in st.session_state.df_player_dict[player].iterrows():
-            if position[0] not in st.session_state.df_all_dict:
-                st.session_state.df_all_dict[position[0]] = df_all_player.copy()
-            df_tmp = pd.DataFrame([position[1]], index={player})
-            st.session_state.df_all_dict[position[0]] = pd.concat(
-                [st.session_state.df_all_dict[position[0]], df_tmp]
-            )
+@st.cache_resource
+def get_client():
+    # クライアントと接続のプールはプロセスで 1 つだけ作って使い回す
+    # (重いライブラリは make_client の中で読み込む)
+    return make_client(credentials_info=st.secrets["gcp_service_account"])
 
-    df_all_champion = pd.DataFrame(
-        index=[],
-        columns=st.session_state.df_champion_dict[
-            next(iter(st.session_state.df_champion_dict))
-        ].columns,
-    )
-    for champion in st.session_state.df_champion_dict.keys():
-        for position in st.session_state.df_champion_dict[champion].iterrows():
-            if position[0] not in st.session_state.df_all_champion_dict:
-                st.session_state.df_all_champion_dict[
-                    position[0]
-                ] = df_all_champion.copy()
-            df_tmp = pd.DataFrame([position[1]], index={champion})
-            st.session_state.df_all_champion_dict[position[0]] = pd.concat(
-                [st.session_state.df_all_champion_dict[position[0]], df_tmp]
-            )
 
-    df_all_set = pd.DataFrame(
-        index=[],
-        columns=st.session_state.df_set_dict[
-            next(iter(st.session_state.df_set_dict))
-        ].columns,
-    )
-    for (player, champion) in st.session_state.df_set_dict.keys():
-        if player not in st.session_state.df_all_set_dict:
-            st.session_state.df_all_set_dict[player] = df_all_set.copy()
-        st.session_state.df_all_set_dict[player] = pd.concat(
-            [
-                st.session_state.df_all_set_dict[player],
-                st.session_state.df_set_dict[(player, champion)][:1].rename(
-                    index={"ALL": champion}
-                ),
-            ]
-        )
+def load_snapshot(refresh=False):
+    return get_snapshot(get_client, refresh=refresh)
 
 
 def cell_style(value):
@@ -371,556 +58,366 @@ def cell_style(value):
         return "background-color: white; color: black"
 
 
+RECORD_FORMATTER = {
+    "match_count": "{:.0f}",
+    "win_count": "{:.0f}",
+    "win_rate": "{:.2f}",
+    "kill": "{:.1f}",
+    "death": "{:.1f}",
+    "assist": "{:.1f}",
+    "kda": "{:.2f}",
+    "cs": "{:.0f}",
+    "gold": "{:.0f}",
+    "c_ward": "{:.1f}",
+    "rating": "{:.1f}",
+}
+PLAYER_FORMATTER = {
+    key: value
+    for key, value in RECORD_FORMATTER.items()
+    if key not in ("match_count", "win_count")
+}
+PAIR_FORMATTER = {
+    "together_win_rate": "{:.2f}",
+    "against_win_rate": "{:.2f}",
+}
+HISTORY_PAGE_SIZES = [10, 20, 50]
+BENZAITEN_PAGE_SIZE = 10
+CHART_POINTS = 500
+TEXT_COLOR_THRESHOLD = 0.408
+GRADIENT_COLUMNS = [
+    "match_count",
+    "win_count",
+    "win_rate",
+    "kill",
+    "death",
+    "assist",
+    "kda",
+    "cs",
+    "gold",
+    "c_ward",
+]
+
+
+def gradient_css(values, cmap):
+    # background_gradient と同じ色付け (列の最小から最大を cmap の色に対応させ、
+    # 背景の相対輝度が TEXT_COLOR_THRESHOLD 未満なら文字を白くする)
+    from matplotlib import colormaps, colors
+
+    norm = colors.Normalize(np.nanmin(values), np.nanmax(values))
+    rgba = colormaps[cmap](norm(values))
+    rgb = rgba[:, :3]
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    dark = linear @ [0.2126, 0.7152, 0.0722] < TEXT_COLOR_THRESHOLD
+    return [
+        f"background-color: {colors.rgb2hex(c)}; color: {'#f1f1f1' if d else '#000000'}"
+        for c, d in zip(rgba, dark)
+    ]
+
+
+def table_css(df, gradient_columns, tier):
+    # 色付けをセルごとの CSS の表にしておく
+    css = pd.DataFrame("", index=df.index, columns=df.columns)
+    for column in gradient_columns:
+        cmap = "RdYlGn_r" if column == "death" else "RdYlGn"
+        css[column] = gradient_css(df[column].to_numpy(dtype=float), cmap)
+    if tier:
+        css["tier"] = df["tier"].map(cell_style)
+    return css
+
+
+def styled_table(snapshot, name, key, formatter, gradient_columns=(), tier=False):
+    # 表示する表だけスタイルを作り、色付けの計算はスナップショットごとに 1 度だけ
+    df = getattr(snapshot, name)[key]
+    styler = df.style.format(formatter=formatter, na_rep="-")
+    if gradient_columns or tier:
+
+        def compute():
+            with span("page.table_css"):
+                return table_css(df, gradient_columns, tier)
+
+        css = snapshot.memo(("table_css", name, key), compute)
+        styler = styler.apply(lambda _: css, axis=None)
+    return styler
+
+
+def rating_chart(snapshot, player, band=False):
+    # レート推移の画像はスナップショットごとに 1 度だけ描き、長い履歴は間引く
+    def render():
+        from matplotlib.figure import Figure
+
+        _, mu, sigma = snapshot.ratings.series(player, "ALL")
+        index = minmax_indices(mu, CHART_POINTS)
+        # pyplot を通さない Figure は描画後に参照が無くなれば解放される
+        fig = Figure(figsize=(12, 4))
+        ax = fig.subplots()
+        if band:
+            ax.fill_between(
+                index, mu[index] - sigma[index], mu[index] + sigma[index], alpha=0.2
+            )
+        ax.plot(index, mu[index], marker="o" if len(index) == len(mu) else None)
+        ax.set_xlabel("match count")
+        ax.set_ylabel("rating")
+        ax.grid(axis="y")
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+        return buffer.getvalue()
+
+    return snapshot.memo(("rating_chart", player, band), render)
+
+
 def page_record():
     with st.spinner("読み込み中"):
-        if st.button("データ更新"):
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-        if "df_all_dict" not in st.session_state:
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-
-        if "df_all_dict" in st.session_state:
-            df_all_dict_styler = {}
-            for keys in st.session_state.df_all_dict.keys():
-                st.session_state.df_all_dict[keys] = st.session_state.df_all_dict[
-                    keys
-                ].sort_values("rating", ascending=False)
-                df_all_dict_styler[keys] = (
-                    st.session_state.df_all_dict[keys]
-                    .style.format(
-                        formatter={
-                            "match_count": "{:.0f}",
-                            "win_count": "{:.0f}",
-                            "win_rate": "{:.2f}",
-                            "kill": "{:.1f}",
-                            "death": "{:.1f}",
-                            "assist": "{:.1f}",
-                            "kda": "{:.2f}",
-                            "cs": "{:.0f}",
-                            "gold": "{:.0f}",
-                            "c_ward": "{:.1f}",
-                            "rating": "{:.1f}",
-                        },
-                        na_rep="-",
+        snapshot = load_snapshot(refresh=st.button("データ更新"))
+        tab3, tab4 = st.tabs(["総合戦績", "個人戦績"])
+        with tab3:
+            if snapshot.df_all_dict != {}:
+                option1 = st.selectbox("ポジションの選択", snapshot.df_all_dict.keys())
+                st.dataframe(
+                    styled_table(
+                        snapshot,
+                        "df_all_dict",
+                        option1,
+                        RECORD_FORMATTER,
+                        GRADIENT_COLUMNS + ["rating"],
+                        tier=True,
                     )
-                    .background_gradient(axis=0, subset="match_count", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="win_count", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="win_rate", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="kill", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="death", cmap="RdYlGn_r")
-                    .background_gradient(axis=0, subset="assist", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="kda", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="cs", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="gold", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="c_ward", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="rating", cmap="RdYlGn")
-                    .applymap(cell_style, subset="tier")
-                )
-            df_all_champion_dict_styler = {}
-            for keys in st.session_state.df_all_champion_dict.keys():
-                st.session_state.df_all_champion_dict[
-                    keys
-                ] = st.session_state.df_all_champion_dict[keys].sort_values(
-                    "match_count", ascending=False
                 )
-                df_all_champion_dict_styler[keys] = (
-                    st.session_state.df_all_champion_dict[keys]
-                    .style.format(
-                        formatter={
-                            "match_count": "{:.0f}",
-                            "win_count": "{:.0f}",
-                            "win_rate": "{:.2f}",
-                            "kill": "{:.1f}",
-                            "death": "{:.1f}",
-                            "assist": "{:.1f}",
-                            "kda": "{:.2f}",
-                            "cs": "{:.0f}",
-                            "gold": "{:.0f}",
-                            "c_ward": "{:.1f}",
-                            "rating": "{:.1f}",
-                        },
-                        na_rep="-",
+                st.dataframe(
+                    styled_table(
+                        snapshot,
+                        "df_all_champion_dict",
+                        option1,
+                        RECORD_FORMATTER,
+                        GRADIENT_COLUMNS,
                     )
-                    .background_gradient(axis=0, subset="match_count", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="win_count", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="win_rate", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="kill", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="death", cmap="RdYlGn_r")
-                    .background_gradient(axis=0, subset="assist", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="kda", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="cs", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="gold", cmap="RdYlGn")
-                    .background_gradient(axis=0, subset="c_ward", cmap="RdYlGn")
                 )
-            df_all_set_dict_styler = {}
-            for keys in st.session_state.df_all_set_dict.keys():
-                st.session_state.df_all_set_dict[
-                    keys
-                ] = st.session_state.df_all_set_dict[keys].sort_values(
-                    "match_count", ascending=False
+        with tab4:
+            if len(snapshot.df_player_dict):
+                col1, col2 = st.columns(2)
+                with col1:
+                    option2 = st.selectbox(
+                        "プレイヤーの選択", snapshot.df_player_dict.keys()
+                    )
+                with col2:
+                    current = snapshot.ratings.rating(option2, "ALL")
+                    previous = snapshot.ratings.rating(option2, "ALL", back=1)
+                    st.metric(
+                        label="現在レート",
+                        value=round(current.mu, 2),
+                        delta=round(current.mu - previous.mu, 2),
+                    )
+
+                st.dataframe(
+                    styled_table(snapshot, "df_player_dict", option2, PLAYER_FORMATTER)
                 )
-                df_all_set_dict_styler[keys] = st.session_state.df_all_set_dict[
-                    keys
-                ].style.format(
-                    formatter={
-                        "match_count": "{:.0f}",
-                        "win_count": "{:.0f}",
-                        "win_rate": "{:.2f}",
-                        "kill": "{:.1f}",
-                        "death": "{:.1f}",
-                        "assist": "{:.1f}",
-                        "kda": "{:.2f}",
-                        "cs": "{:.0f}",
-                        "gold": "{:.0f}",
-                        "c_ward": "{:.1f}",
-                        "rating": "{:.1f}",
-                    },
-                    na_rep="-",
+                st.dataframe(
+                    styled_table(snapshot, "df_all_set_dict", option2, RECORD_FORMATTER)
                 )
 
-            # フォーマット
-            df_player_dict_styler = {}
-            for keys in st.session_state.df_player_dict.keys():
-                df_player_dict_styler[keys] = st.session_state.df_player_dict[
-                    keys
-                ].style.format(
-                    formatter={
-                        "win_rate": "{:.2f}",
-                        "kill": "{:.1f}",
-                        "death": "{:.1f}",
-                        "assist": "{:.1f}",
-                        "kda": "{:.2f}",
-                        "cs": "{:.0f}",
-                        "gold": "{:.0f}",
-                        "c_ward": "{:.1f}",
-                        "rating": "{:.1f}",
-                    },
-                    na_rep="-",
+                st.write("ペア成績")
+                partners = snapshot.memo(
+                    ("partners", option2), lambda: snapshot.pairs.partners(option2)
                 )
-            df_champion_dict_styler = {}
-            for keys in st.session_state.df_champion_dict.keys():
-                df_champion_dict_styler[keys] = st.session_state.df_champion_dict[
-                    keys
-                ].style.format(
-                    formatter={
-                        "win_rate": "{:.2f}",
-                        "kill": "{:.1f}",
-                        "death": "{:.1f}",
-                        "assist": "{:.1f}",
-                        "kda": "{:.2f}",
-                        "cs": "{:.0f}",
-                        "gold": "{:.0f}",
-                        "c_ward": "{:.1f}",
-                        "rating": "{:.1f}",
-                    },
-                    na_rep="-",
-                )
-            tab3, tab4 = st.tabs(["総合戦績", "個人戦績"])
-            with tab3:
-                if df_all_dict_styler != {}:
-                    option1 = st.selectbox("ポジションの選択", df_all_dict_styler.keys())
-                    st.dataframe(df_all_dict_styler[option1])
-                    st.dataframe(df_all_champion_dict_styler[option1])
-            with tab4:
-                if df_player_dict_styler != {}:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        option2 = st.selectbox("プレイヤーの選択", df_player_dict_styler.keys())
-                    with col2:
-                        st.metric(
-                            label="現在レート",
-                            value=round(
-                                st.session_state.rate_dict[option2]["ALL"][0].mu, 2
-                            ),
-                            delta=round(
-                                st.session_state.rate_dict[option2]["ALL"][0].mu
-                                - st.session_state.rate_dict[option2]["ALL"][1].mu,
-                                2,
-                            ),
-                        )
-
-                    st.dataframe(df_player_dict_styler[option2])
-                    st.dataframe(df_all_set_dict_styler[option2])
-
-                    st.write("レート変動")
-                    mu_list = [
-                        mu for mu, _ in st.session_state.rate_dict[option2]["ALL"]
-                    ]
-                    mu_list.reverse()
-                    match_cnt_list = [
-                        i
-                        for i in range(len(st.session_state.rate_dict[option2]["ALL"]))
-                    ]
-                    fig, ax = plt.subplots(figsize=(12, 4))
-                    ax.plot(match_cnt_list, mu_list, marker="o")
-                    ax.set_xlabel("match count")
-                    ax.set_ylabel("rating")
-                    ax.grid(axis="y")
-                    st.pyplot(fig)
+                st.dataframe(partners.style.format(formatter=PAIR_FORMATTER))
+
+                st.write("レート変動")
+                band = st.checkbox("σ の範囲を表示", key="rating_band")
+                st.image(rating_chart(snapshot, option2, band))
+
+
+def option_label(value):
+    return "すべて" if value is None else value
 
 
 def page_history():
     with st.spinner("読み込み中"):
-        if st.button("データ更新"):
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-        if "df_list" not in st.session_state:
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-        if "df_list" in st.session_state:
-            i = len(list(st.session_state.df_list))
-            for df in reversed(list(st.session_state.df_list)):
-                st.write(f"match {i}")
-                df = df.set_index("player", drop=False)
-                df = df.rename(
-                    columns={
-                        "championsKilled": "kill",
-                        "assists": "assist",
-                        "goldEarned": "gold",
-                        "individualPosition": "position",
-                        "numDeaths": "death",
-                        "skin": "champion",
-                        "team": "side",
-                        "visionWardsBoughtInGame": "c_ward",
-                    }
-                )
-                df.loc[df["death"] == 0, "kda"] = df["kill"] + df["assist"]
-                df.loc[~(df["death"] == 0), "kda"] = (df["kill"] + df["assist"]) / df[
-                    "death"
-                ]
-                df["cs"] = df["minionsKilled"] + df["neutralMinionsKilled"]
-                df1 = df[0:5]
-                df2 = df[5:10]
-                pos_order = ["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"]
-                df_cp1 = df1.copy()
-                df_cp2 = df2.copy()
-                df_cp1.loc[:, "order"] = df1["position"].apply(
-                    lambda x: pos_order.index(x) if x in pos_order else -1
-                )
-                df_cp2.loc[:, "order"] = df2["position"].apply(
-                    lambda x: pos_order.index(x) if x in pos_order else -1
-                )
-                df_cp1 = df_cp1.sort_values("order")
-                df_cp2 = df_cp2.sort_values("order")
-                drop_col = [
-                    "player",
-                    "order",
-                    "minionsKilled",
-                    "neutralMinionsKilled",
-                    "position",
-                ]
-                df_cp1 = df_cp1.drop(drop_col, axis=1)
-                df_cp2 = df_cp2.drop(drop_col, axis=1)
-                columns_order = [
-                    "champion",
-                    "kill",
-                    "death",
-                    "assist",
-                    "kda",
-                    "cs",
-                    "gold",
-                    "c_ward",
-                    "win",
-                    "side",
-                ]
-                df_cp1 = df_cp1.reindex(columns=columns_order)
-                df_cp2 = df_cp2.reindex(columns=columns_order)
-                df_cp1 = df_cp1.style.format(formatter={"kda": "{:.2f}"})
-                df_cp2 = df_cp2.style.format(formatter={"kda": "{:.2f}"})
-                st.table(df_cp1)
-                st.table(df_cp2)
-                i -= 1
+        snapshot = load_snapshot(refresh=st.button("データ更新"))
+        history = snapshot.history
+        players, champions = snapshot.memo(
+            "history_options",
+            lambda: (
+                sorted(pd.unique(history.table.index)),
+                sorted(pd.unique(history.table["champion"])),
+            ),
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            player = st.selectbox(
+                "プレイヤー", [None] + players, format_func=option_label
+            )
+        with col2:
+            champion = st.selectbox(
+                "チャンピオン", [None] + champions, format_func=option_label
+            )
+        with col3:
+            page_size = st.selectbox("表示件数", HISTORY_PAGE_SIZES)
+        numbers = history.find(player, champion)
+        pages = max(1, -(-len(numbers) // page_size))
+        page = st.number_input("ページ", min_value=1, max_value=pages, value=1)
+        st.caption(f"{len(numbers)} 試合 ({page}/{pages} ページ)")
+        start = (page - 1) * page_size
+        end = start + page_size
+        for number in numbers[start:end]:
+            st.write(f"match {number}")
+            for team in history.teams(number):
+                st.table(team.style.format(formatter={"kda": "{:.2f}"}))
+
+
+def lineup_table(team, ranks):
+    return pd.DataFrame({"プレイヤー": team, "希望順位": ranks}, index=list(team))
+
+
+def show_proposal(proposal):
+    ave_rate = proposal.ave_rate
+    wp = proposal.win_probability
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write(f"チームA平均レート: {ave_rate[0]:.1f}")
+        st.table(lineup_table(proposal.teams[0], proposal.ranks[0]))
+    with col2:
+        st.write(f"チームB平均レート: {ave_rate[1]:.1f}")
+        st.table(lineup_table(proposal.teams[1], proposal.ranks[1]))
+    st.write(f"勝敗予測: {wp*100.0:.0f}%")
+    my_bar = st.progress(0)
+    my_bar.progress(wp)
 
 
 def page_balancer():
     with st.spinner("読み込み中"):
-        if st.button("データ更新"):
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-        if "df_player_dict" not in st.session_state:
-            for key in st.session_state.keys():
-                del st.session_state[key]
-            get_all_record()
-        if "df_player_dict" in st.session_state:
-            position_idx = ["ALL", "TOP", "JNG", "MID", "BOT", "SUP"]
-            tab1, tab2 = st.tabs(["チームバランサー", "シミュレーター"])
-            with tab1:
-                options5 = st.multiselect(
-                    "参加者", st.session_state.df_player_dict.keys(), []
-                )
-                if len(options5) == 10:
-                    st.button("再振り分け")
-                    wp_min = 0.35
-                    wp_max = 0.65
-                    wp = 0.0
-                    wp_cnt = 0
-                    while wp < wp_min or wp > wp_max:
-                        priority_checking = True
-                        priority_cnt = 0
-                        priority_threshold = 2
-                        while priority_checking:
-                            wp_all_cnt = 0
-                            wp_all = 0.0
-                            wp_all_min = 0.4
-                            wp_all_max = 0.6
-                            while wp_all < wp_all_min or wp_all > wp_all_max:
-                                options5 = random.sample(options5, 10)
-                                a = options5[:5]
-                                b = options5[5:]
-                                t3 = []
-                                t4 = []
-                                for player in a:
-                                    t3.append(
-                                        st.session_state.rate_dict[player]["ALL"][0]
-                                    )
-                                for player in b:
-                                    t4.append(
-                                        st.session_state.rate_dict[player]["ALL"][0]
-                                    )
-                                wp_all = win_probability(
-                                    t3, t4, env=st.session_state.env
-                                )
-                                wp_all_cnt += 1
-                                if wp_all_cnt % 5 == 0:
-                                    wp_all_min -= 0.01
-                                    wp_all_max += 0.01
-                            teams = [a, b]
-                            team_dict_list = []
-                            ave_rate = []
-                            team_pos = []
-                            for team in teams:
-                                team_pos.append([])
-                                # rate = []
-                                rate_pos = []
-                                team_dict = {}
-                                # for player in team:
-                                #     rate.append(
-                                #         st.session_state.rate_dict[player]["ALL"][0].mu
-                                #     )
-                                # team = [i for _, i in sorted(zip(rate, team))]
-                                team_list = ["", "", "", "", ""]
-                                priority_sum = True
-                                for player in team:
-                                    tmp_list = [0, 1, 2, 3, 4]
-                                    if (
-                                        player
-                                        in st.session_state.position_priority.keys()
-                                    ):
-                                        tmp_list = [
-                                            i
-                                            for _, i in sorted(
-                                                zip(
-                                                    st.session_state.position_priority[
-                                                        player
-                                                    ],
-                                                    tmp_list,
-                                                )
-                                            )
-                                        ]
-                                    else:
-                                        role_weight = list(
-                                            st.session_state.df_player_dict[player][
-                                                "match_count"
-                                            ][:]
-                                        )
-                                        weight_list = []
-                                        for i in range(5):
-                                            weight_list.append(
-                                                role_weight[i + 1] / role_weight[0]
-                                            )
-                                        tmp_list = [
-                                            i
-                                            for _, i in sorted(
-                                                zip(weight_list, tmp_list), reverse=True
-                                            )
-                                        ]
-                                    for i in range(priority_threshold):
-                                        if team_list[tmp_list[i]] == "":
-                                            team_list[tmp_list[i]] = player
-                                            rate_pos.append(
-                                                st.session_state.rate_dict[player][
-                                                    position_idx[tmp_list[i] + 1]
-                                                ][0].mu
-                                            )
-                                            team_pos[-1].append(
-                                                st.session_state.rate_dict[player][
-                                                    position_idx[tmp_list[i] + 1]
-                                                ][0]
-                                            )
-                                            break
-                                        else:
-                                            if i == priority_threshold - 1:
-                                                priority_sum = False
-                                if priority_sum:
-                                    priority_checking = False
-                                else:
-                                    priority_checking = True
-                                    priority_cnt += 1
-                                    if priority_cnt % 100 == 0:
-                                        priority_threshold += 1
-                                    break
-                                ave_rate.append(statistics.mean(rate_pos))
-                                team_dict["TOP"] = team_list[0]
-                                team_dict["JNG"] = team_list[1]
-                                team_dict["MID"] = team_list[2]
-                                team_dict["BOT"] = team_list[3]
-                                team_dict["SUP"] = team_list[4]
-                                team_dict_list.append(team_dict)
-                        wp = win_probability(
-                            team_pos[0], team_pos[1], env=st.session_state.env
-                        )
-                        wp_cnt += 1
-                        if wp_cnt % 2 == 0:
-                            wp_min -= 0.01
-                            wp_max += 0.01
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"チームA平均レート: {ave_rate[0]:.1f}")
-                        st.write(team_dict_list[0])
-                    with col2:
-                        st.write(f"チームB平均レート: {ave_rate[1]:.1f}")
-                        st.write(team_dict_list[1])
-                    st.write(f"勝敗予測: {wp*100.0:.0f}%")
-                    my_bar = st.progress(0)
-                    my_bar.progress(wp)
-                else:
-                    st.write(f"{len(options5)} / 10")
-            with tab2:
-                top_col, jng_col, mid_col, bot_col, sup_col = st.columns(5)
-                with top_col:
-                    p0 = st.selectbox(
-                        "TOP", st.session_state.df_player_dict.keys(), key="t1_t"
-                    )
-                    p5 = st.selectbox(
-                        "TOP", st.session_state.df_player_dict.keys(), key="t2_t"
-                    )
-                with jng_col:
-                    p1 = st.selectbox(
-                        "JNG", st.session_state.df_player_dict.keys(), key="t1_j"
-                    )
-                    p6 = st.selectbox(
-                        "JNG", st.session_state.df_player_dict.keys(), key="t2_j"
-                    )
-                with mid_col:
-                    p2 = st.selectbox(
-                        "MID", st.session_state.df_player_dict.keys(), key="t1_m"
-                    )
-                    p7 = st.selectbox(
-                        "MID", st.session_state.df_player_dict.keys(), key="t2_m"
-                    )
-                with bot_col:
-                    p3 = st.selectbox(
-                        "BOT", st.session_state.df_player_dict.keys(), key="t1_b"
-                    )
-                    p8 = st.selectbox(
-                        "BOT", st.session_state.df_player_dict.keys(), key="t2_b"
-                    )
-                with sup_col:
-                    p4 = st.selectbox(
-                        "SUP", st.session_state.df_player_dict.keys(), key="t1_s"
-                    )
-                    p9 = st.selectbox(
-                        "SUP", st.session_state.df_player_dict.keys(), key="t2_s"
-                    )
-                team_a = (
-                    st.session_state.rate_dict[p0]["TOP"][0],
-                    st.session_state.rate_dict[p1]["JNG"][0],
-                    st.session_state.rate_dict[p2]["MID"][0],
-                    st.session_state.rate_dict[p3]["BOT"][0],
-                    st.session_state.rate_dict[p4]["SUP"][0],
-                )
-                team_b = (
-                    st.session_state.rate_dict[p5]["TOP"][0],
-                    st.session_state.rate_dict[p6]["JNG"][0],
-                    st.session_state.rate_dict[p7]["MID"][0],
-                    st.session_state.rate_dict[p8]["BOT"][0],
-                    st.session_state.rate_dict[p9]["SUP"][0],
-                )
-                wp_pos = win_probability(team_a, team_b, env=st.session_state.env)
-                st.write(f"勝敗予測: {wp_pos*100.0:.0f}%")
-                my_bar_pos = st.progress(0)
-                my_bar_pos.progress(wp_pos)
+        snapshot = load_snapshot(refresh=st.button("データ更新"))
+        tab1, tab2 = st.tabs(["チームバランサー", "シミュレーター"])
+        with tab1:
+            options5 = st.multiselect("参加者", snapshot.df_player_dict.keys(), [])
+            avoid_pairs = st.checkbox("よく同じチームになるペアを分ける")
+            if len(options5) == 10:
+                # データが更新されたら案の数も変わりうるので最初の案に戻す
+                balance_key = (snapshot.version, tuple(sorted(options5)), avoid_pairs)
+                proposals = team_proposals(snapshot, options5, avoid_pairs)
+                if st.session_state.get("balance_key") != balance_key:
+                    st.session_state.balance_key = balance_key
+                    st.session_state.balance_idx = 0
+                if st.button("再振り分け"):
+                    st.session_state.balance_idx += 1
+                balance_idx = st.session_state.balance_idx % len(proposals)
+                st.caption(f"案 {balance_idx + 1} / {len(proposals)}")
+                show_proposal(proposals[balance_idx])
+            elif len(options5) > 10 and len(options5) % 10 == 0:
+                # 20 人以上は 10 人ずつのロビーに分ける
+                lobbies = lobby_proposals(snapshot, options5, avoid_pairs=avoid_pairs)
+                for i, proposal in enumerate(lobbies, 1):
+                    st.subheader(f"ロビー {i}")
+                    show_proposal(proposal)
+            else:
+                st.write(f"{len(options5)} / {max(10, -(-len(options5) // 10) * 10)}")
+        with tab2:
+            top_col, jng_col, mid_col, bot_col, sup_col = st.columns(5)
+            with top_col:
+                p0 = st.selectbox("TOP", snapshot.df_player_dict.keys(), key="t1_t")
+                p5 = st.selectbox("TOP", snapshot.df_player_dict.keys(), key="t2_t")
+            with jng_col:
+                p1 = st.selectbox("JNG", snapshot.df_player_dict.keys(), key="t1_j")
+                p6 = st.selectbox("JNG", snapshot.df_player_dict.keys(), key="t2_j")
+            with mid_col:
+                p2 = st.selectbox("MID", snapshot.df_player_dict.keys(), key="t1_m")
+                p7 = st.selectbox("MID", snapshot.df_player_dict.keys(), key="t2_m")
+            with bot_col:
+                p3 = st.selectbox("BOT", snapshot.df_player_dict.keys(), key="t1_b")
+                p8 = st.selectbox("BOT", snapshot.df_player_dict.keys(), key="t2_b")
+            with sup_col:
+                p4 = st.selectbox("SUP", snapshot.df_player_dict.keys(), key="t1_s")
+                p9 = st.selectbox("SUP", snapshot.df_player_dict.keys(), key="t2_s")
+            team_a = (
+                snapshot.ratings.rating(p0, "TOP"),
+                snapshot.ratings.rating(p1, "JNG"),
+                snapshot.ratings.rating(p2, "MID"),
+                snapshot.ratings.rating(p3, "BOT"),
+                snapshot.ratings.rating(p4, "SUP"),
+            )
+            team_b = (
+                snapshot.ratings.rating(p5, "TOP"),
+                snapshot.ratings.rating(p6, "JNG"),
+                snapshot.ratings.rating(p7, "MID"),
+                snapshot.ratings.rating(p8, "BOT"),
+                snapshot.ratings.rating(p9, "SUP"),
+            )
+            wp_pos = win_probability(team_a, team_b, env=snapshot.env)
+            st.write(f"勝敗予測: {wp_pos*100.0:.0f}%")
+            my_bar_pos = st.progress(0)
+            my_bar_pos.progress(wp_pos)
 
 
 def page_benzaiten():
     st.title("今日の弁財天")
 
-    path = "benzaiten.txt"
-    images_path = "images.txt"
-    cnt = 0
-    all_lines = []
+    feed = open_feed()
+    images = ImageStore()
 
     def update(text, uploaded_file):
-        with open(path, "r") as f:
-            lines = f.readlines()
-        with open(path, "w") as f:
-            if text != "":
-                with open(images_path, "r") as fp:
-                    path_lines = fp.readlines()
-                path_lines.insert(0, f"{uploaded_file.name}\n")
-                with open(images_path, "w") as fp:
-                    for path_line in path_lines:
-                        fp.write(path_line)
-                img = Image.open(uploaded_file)
-                orientation = ImageOps.exif_transpose(img)
-                orientation.save(f"images/{uploaded_file.name}")
-                dt_now = datetime.now(ZoneInfo("Asia/Tokyo"))
-                lines.insert(
-                    0, f"[{dt_now.strftime('%Y年%m月%d日 %H:%M:%S')}]    {text}\n"
-                )
-            for line in lines:
-                f.write(line)
-
-    def delete(i):
-        with open(path, "r") as f:
-            lines = f.readlines()
-        with open(path, "w") as f:
-            for j, line in enumerate(lines):
-                if j != i:
-                    f.write(line)
-        with open(images_path, "r") as f:
-            lines = f.readlines()
-        with open(images_path, "w") as f:
-            for j, line in enumerate(lines):
-                if j != i:
-                    f.write(line)
+        if text != "":
+            # 同じ画像は内容のハッシュで 1 つにまとめ、縮小版もここで作る
+            name = images.add(uploaded_file.getvalue(), uploaded_file.name)
+            dt_now = datetime.now(ZoneInfo("Asia/Tokyo"))
+            feed.post(dt_now.strftime("%Y年%m月%d日 %H:%M:%S"), text, name)
 
     with st.form(key="my_form", clear_on_submit=True):
         text = st.text_input("コメント", value="", key="text_value")
-        uploaded_file = st.file_uploader(label="画像を選択", type=["png", "jpeg", "jpg"])
+        uploaded_file = st.file_uploader(
+            label="画像を選択", type=["png", "jpeg", "jpg"]
+        )
         if st.form_submit_button(label="送信"):
             if uploaded_file is not None:
                 update(text, uploaded_file)
 
-    with open(path, "r") as f:
-        for s_line in f:
-            all_lines.append(s_line)
-            cnt += 1
-    with open(images_path, "r") as fp:
-        image_paths = fp.readlines()
-    for i in range(cnt):
-        with st.form(key=f"form_{i}", clear_on_submit=True):
-            st.write(all_lines[i])
-            st.image(f"images/{image_paths[i].rstrip()}")
-            if st.form_submit_button(label="削除"):
-                delete(i)
+    # 新しい順に 1 ページ分だけ読む
+    pages = max(1, -(-len(feed) // BENZAITEN_PAGE_SIZE))
+    page = st.number_input("ページ", min_value=1, max_value=pages, value=1)
+    posts, total = feed.page(page - 1, BENZAITEN_PAGE_SIZE)
+    st.caption(f"{total} 件 ({page}/{pages} ページ)")
+    manifest = images.manifest()
+    for post in posts:
+        st.write(f"[{post['time']}]    {post['text']}")
+        # 一覧には縮小版を出し、元の画像は選んだときだけ送る
+        st.image(images.thumbnail(post["image"], manifest=manifest))
+        if st.checkbox("元の画像", key=f"original_{post['id']}"):
+            st.image(images.original(post["image"]))
+        if st.button("削除", key=f"delete_{post['id']}"):
+            feed.delete(post["id"])
+            st.rerun()
+
+
+def diagnostics_panel():
+    # URL に ?diagnostics を付けたときだけサイドバーに処理時間を出す
+    summary = timings.summary()
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        if summary["spans"]:
+            df = pd.DataFrame.from_dict(summary["spans"], orient="index")
+            st.dataframe(
+                df[["last", "mean", "max", "count"]].style.format(
+                    formatter={"last": "{:.3f}", "mean": "{:.3f}", "max": "{:.3f}"}
+                )
+            )
+        st.json(summary["counters"])
+        st.download_button(
+            "JSON",
+            timings.to_json(indent=2),
+            file_name="timings.json",
+            mime="application/json",
+        )
 
 
 selected_page = st.sidebar.radio("Menu", ["Record", "History", "Balancer", "Benzaiten"])
 
-if selected_page == "Record":
-    page_record()
-elif selected_page == "History":
-    page_history()
-elif selected_page == "Balancer":
-    page_balancer()
-elif selected_page == "Benzaiten":
-    page_benzaiten()
-else:
-    pass
+with span(f"page.{selected_page}"):
+    if selected_page == "Record":
+        page_record()
+    elif selected_page == "History":
+        page_history()
+    elif selected_page == "Balancer":
+        page_balancer()
+    elif selected_page == "Benzaiten":
+        page_benzaiten()
+    else:
+        pass
+
+if "diagnostics" in st.query_params:
+    diagnostics_panel()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from teambalancer.record import (  # noqa: E402
+    POSITION_IDX,
+    RecordState,
+    build_all_tables,
+    build_stats,
+    new_env,
+)
+
+CHAMPIONS_PER_PLAYER = 40
+GAMES_PER_PAIR = 3
+
+
+def synthetic_matches(pairs, seed=0):
+    # match_table と同じ列の縦長テーブルを、(プレイヤー, チャンピオン) が pairs 通りになるよう作る
+    rng = np.random.default_rng(seed)
+    n_players = max(10, -(-pairs // CHAMPIONS_PER_PLAYER))
+    n_champions = max(CHAMPIONS_PER_PLAYER, 160)
+    player = np.repeat(np.arange(n_players), CHAMPIONS_PER_PLAYER)[:pairs]
+    champion = np.concatenate(
+        [
+            rng.choice(n_champions, CHAMPIONS_PER_PLAYER, replace=False)
+            for _ in range(n_players)
+        ]
+    )[:pairs]
+    player = np.repeat(player, GAMES_PER_PAIR)
+    champion = np.repeat(champion, GAMES_PER_PAIR)
+    order = rng.permutation(len(player))
+    player, champion = player[order], champion[order]
+    rows = len(player)
+    return pd.DataFrame(
+        {
+            "match": (np.arange(rows) // 10).astype("int32"),
+            "player": pd.Categorical([f"player{i}" for i in player]),
+            "champion": pd.Categorical([f"champion{i}" for i in champion]),
+            "position": pd.Categorical.from_codes(
+                np.arange(rows) % 5, categories=POSITION_IDX[1:]
+            ),
+            "team": np.where(np.arange(rows) % 10 < 5, 100, 200).astype("int16"),
+            "win": (np.arange(rows) // 10 + (np.arange(rows) % 10 < 5)) % 2 == 0,
+            "kill": rng.integers(0, 15, rows, dtype="int32"),
+            "death": rng.integers(0, 15, rows, dtype="int32"),
+            "assist": rng.integers(0, 25, rows, dtype="int32"),
+            "cs": rng.integers(0, 300, rows, dtype="int32"),
+            "gold": rng.integers(5000, 20000, rows, dtype="int32"),
+            "c_ward": rng.integers(0, 10, rows, dtype="int32"),
+        }
+    )
+
+
+def synthetic_state(matches, env):
+    # レートの再計算は測らないので、全員を初期レートで登録しておく
+    state = RecordState()
+    for player in matches["player"].cat.categories:
+        state.ratings.add_player(player, POSITION_IDX, env.create_rating())
+    return state
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全体集計表の作成時間を測る")
+    parser.add_argument(
+        "--pairs", type=int, nargs="+", default=[100, 1000, 3000, 10000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    env = new_env()
+    print(f"{'pairs':>8} {'rows':>8} {'stats [s]':>10} {'tables [s]':>11}")
+    for pairs in args.pairs:
+        matches = synthetic_matches(pairs)
+        state = synthetic_state(matches, env)
+        stats_time, views = timed(lambda: build_stats(state, matches), args.repeat)
+        tables_time, tables = timed(lambda: build_all_tables(*views), args.repeat)
+        assert len(tables[0]["ALL"]) == len(views[0])
+        assert sum(len(df) for df in tables[2].values()) == len(views[2])
+        print(f"{pairs:>8} {len(matches):>8} {stats_time:>10.3f} {tables_time:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from synthetic import generate_bucket  # noqa: E402
+
+from teambalancer.balancer import balance_teams, position_order  # noqa: E402
+from teambalancer.fakestorage import FakeStorageClient  # noqa: E402
+from teambalancer.matchstore import MatchStore  # noqa: E402
+from teambalancer.record import (  # noqa: E402
+    RecordState,
+    build_all_tables,
+    build_stats,
+    match_history,
+    match_table,
+    new_env,
+    replay,
+)
+from teambalancer.storage import (  # noqa: E402
+    BUCKET_NAME,
+    CONFIG_FILES,
+    get_blobs,
+    get_dataframe,
+)
+
+SIZES = [100, 1000, 10000, 100000]
+STAGES = [
+    "ingest",
+    "match_table",
+    "replay",
+    "stats",
+    "leaderboards",
+    "history",
+    "balance",
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_pipeline(root, workdir):
+    # アプリのスナップショット作成と同じ順に処理し、段階ごとの時間を測る
+    times = {}
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        result = func()
+        times[stage] = time.perf_counter() - start
+        return result
+
+    client = FakeStorageClient(root)
+    env = new_env()
+    env.make_as_global()
+    store = MatchStore(os.path.join(workdir, "matches"))
+
+    def ingest():
+        blobs = list(get_blobs(BUCKET_NAME, client))
+        return blobs, get_dataframe(blobs, BUCKET_NAME, client, store)
+
+    blobs, (raw, name_dict, position_priority) = timed("ingest", ingest)
+    match_blobs = [blob.name for blob in blobs if blob.name not in CONFIG_FILES]
+    matches = timed("match_table", lambda: match_table(raw, name_dict, match_blobs))
+    state = RecordState(name_dict=name_dict)
+    timed("replay", lambda: replay(state, matches, match_blobs, env))
+    views = timed("stats", lambda: build_stats(state, matches))
+    timed("leaderboards", lambda: build_all_tables(*views))
+    timed("history", lambda: match_history(raw, match_blobs))
+
+    # 試合数の多い 10 人で 1 試合分のチーム分け
+    players = list(matches["player"].value_counts().index[:10])
+
+    def balance():
+        orders = {
+            player: position_order(player, position_priority, views[0])
+            for player in players
+        }
+        return balance_teams(players, state.ratings, orders, env=env)
+
+    timed("balance", balance)
+    return {"rows": len(matches), "players": len(views[0]), "seconds": times}
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {r["matches"]: r["seconds"] for r in baseline["results"]}
+    print(f"\ncompared with {baseline.get('commit')} ({baseline_path})")
+    for result in results:
+        if result["matches"] not in old:
+            continue
+        ratios = [
+            f"{stage}={result['seconds'][stage] / old[result['matches']][stage]:.2f}x"
+            for stage in STAGES
+            if old[result["matches"]].get(stage)
+        ]
+        print(f"{result['matches']:>7} " + " ".join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ダミーデータで集計の各段階の時間を測る"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--champions", type=int, default=160)
+    parser.add_argument("--aliases", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="cache/benchmark.json")
+    parser.add_argument("--compare", help="以前の結果 (JSON) との比を表示する")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'matches':>7} " + " ".join(f"{stage:>12}" for stage in STAGES))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            generate_bucket(
+                os.path.join(tmp, "bucket"),
+                size,
+                players=args.players,
+                champions=args.champions,
+                aliases=args.aliases,
+                seed=args.seed,
+            )
+            result = run_pipeline(os.path.join(tmp, "bucket"), tmp)
+        result["matches"] = size
+        results.append(result)
+        print(
+            f"{size:>7} "
+            + " ".join(f"{result['seconds'][stage]:>12.3f}" for stage in STAGES)
+        )
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "players": args.players,
+            "champions": args.champions,
+            "aliases": args.aliases,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nwrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
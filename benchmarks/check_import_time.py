@@ -0,0 +1,111 @@
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 起動時に読み込まないことにしている重いライブラリ
+DEFERRED = ["matplotlib", "PIL", "google.cloud", "google.oauth2"]
+
+# python -X importtime で測った読み込み時間が、基準の import よりどれだけ増えてよいか
+# (基準, 上限 ミリ秒)
+# 絶対時間はマシンによって大きく揺れるので、同じ実行で交互に測った基準との差で見る
+BUDGETS = {
+    "app": ("import pandas, streamlit", 300),
+    "cli": ("import pandas", 200),
+}
+CLI_IMPORT = "import teambalancer.__main__"
+
+
+def app_imports(path=os.path.join(ROOT, "PlinCustom.py")):
+    # PlinCustom.py のトップレベルの import 文だけを取り出す
+    # (スクリプト自体は Streamlit の外では実行できないため)
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    return "\n".join(
+        ast.get_source_segment(source, node)
+        for node in ast.parse(source).body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def measure(code):
+    # 新しいプロセスで code を実行し、トップレベルの import の合計時間と読み込んだモジュールを返す
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        check=True,
+    )
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.append(name.strip())
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def eager_imports(modules):
+    # modules のうち DEFERRED に含まれるもの
+    return sorted(
+        {
+            prefix
+            for prefix in DEFERRED
+            for module in modules
+            if module == prefix or module.startswith(prefix + ".")
+        }
+    )
+
+
+def targets():
+    return {"app": app_imports(), "cli": CLI_IMPORT}
+
+
+def overhead(code, reference, repeat):
+    # code と reference を交互に測り、それぞれの最小値の差 (ミリ秒) と code の読み込んだモジュール
+    # (ディスクキャッシュの影響を除くため、何回か測って最小値を使う)
+    runs, references = [], []
+    for _ in range(repeat):
+        references.append(measure(reference)[0])
+        runs.append(measure(code))
+    return min(ms for ms, _ in runs) - min(references), runs[0][1]
+
+
+def check(name, code, reference, budget, repeat):
+    extra, modules = overhead(code, reference, repeat)
+    loaded = eager_imports(modules)
+    ok = extra <= budget and not loaded
+    print(
+        f"{name:<4} {extra:+8.1f} ms over {reference!r} (budget {budget} ms) "
+        f"{'ok' if ok else 'NG'}"
+    )
+    if loaded:
+        print(f"     eagerly imported: {', '.join(loaded)}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時の import 時間を確認する")
+    parser.add_argument("--app-budget", type=float, default=BUDGETS["app"][1])
+    parser.add_argument("--cli-budget", type=float, default=BUDGETS["cli"][1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    budgets = {"app": args.app_budget, "cli": args.cli_budget}
+    results = [
+        check(name, code, BUDGETS[name][0], budgets[name], args.repeat)
+        for name, code in targets().items()
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
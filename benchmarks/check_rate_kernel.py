@@ -0,0 +1,136 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from synthetic import generate_bucket  # noqa: E402
+
+from teambalancer.fakestorage import FakeStorageClient  # noqa: E402
+from teambalancer.matchstore import MatchStore  # noqa: E402
+from teambalancer.record import (  # noqa: E402
+    POSITION_IDX,
+    RecordState,
+    match_table,
+    new_env,
+    replay,
+)
+from teambalancer.storage import (  # noqa: E402
+    BUCKET_NAME,
+    CONFIG_FILES,
+    get_blobs,
+    get_dataframe,
+)
+
+# env.rate との差の許容値
+TOLERANCE = 1e-9
+
+
+def reference_replay(state, matches, blob_names, env):
+    # trueskill の因子グラフ (env.rate) でレート計算する以前の実装
+    match = matches["match"].to_numpy()
+    players = matches["player"].to_numpy(dtype=object)
+    positions = matches["position"].to_numpy(dtype=object)
+    teams = matches["team"].to_numpy()
+    wins = matches["win"].to_numpy()
+    bounds = np.flatnonzero(np.diff(match)) + 1
+    for rows in np.split(np.arange(len(matches)), bounds):
+        if len(rows) == 0:
+            continue
+        team1, team2, team1_p, team2_p, team_p2 = {}, {}, {}, {}, {}
+        for i in rows:
+            player_name = players[i]
+            if player_name not in state.ratings:
+                state.ratings.add_player(player_name, POSITION_IDX, env.create_rating())
+            team_p2[player_name] = positions[i]
+            if teams[i] == 100:
+                team1[player_name] = state.ratings.rating(player_name, "ALL")
+                team1_p[player_name] = state.ratings.rating(player_name, positions[i])
+            else:
+                team2[player_name] = state.ratings.rating(player_name, "ALL")
+                team2_p[player_name] = state.ratings.rating(player_name, positions[i])
+        last = rows[-1]
+        win_team = (wins[last] and teams[last] == 100) or (
+            not wins[last] and teams[last] != 100
+        )
+        ranks = (1 - win_team, 0 + win_team)
+        team1, team2 = env.rate((team1, team2), ranks=ranks)
+        team1_p, team2_p = env.rate((team1_p, team2_p), ranks=ranks)
+        for team in (team1, team2):
+            for r_key, rating in team.items():
+                state.ratings.append(r_key, "ALL", match[last], rating)
+        for team in (team1_p, team2_p):
+            for r_key, rating in team.items():
+                state.ratings.append(r_key, team_p2[r_key], match[last], rating)
+    state.blobs = list(blob_names)
+    return state
+
+
+def load_matches(root, workdir):
+    client = FakeStorageClient(root)
+    store = MatchStore(os.path.join(workdir, "matches"))
+    blobs = list(get_blobs(BUCKET_NAME, client))
+    raw, name_dict, _ = get_dataframe(blobs, BUCKET_NAME, client, store)
+    match_blobs = [blob.name for blob in blobs if blob.name not in CONFIG_FILES]
+    return match_table(raw, name_dict, match_blobs), match_blobs, name_dict
+
+
+def max_difference(expected, actual):
+    # 全ての (プレイヤー, ポジション) の推移を比べ、mu と sigma の最大誤差を返す
+    worst = 0.0
+    for player in expected.ratings:
+        for position in POSITION_IDX:
+            old = expected.ratings.series(player, position)
+            new = actual.ratings.series(player, position)
+            if len(old[0]) != len(new[0]) or (old[0] != new[0]).any():
+                raise AssertionError(f"different matches for {player} {position}")
+            worst = max(
+                worst,
+                float(np.abs(old[1] - new[1]).max()),
+                float(np.abs(old[2] - new[2]).max()),
+            )
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="閉じた式のレート更新が env.rate と一致するか全試合で確かめる"
+    )
+    parser.add_argument("--root", help="ローカルのバケット (省略時はダミーデータ)")
+    parser.add_argument("--matches", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root
+        if root is None:
+            root = os.path.join(tmp, "bucket")
+            generate_bucket(root, args.matches, seed=args.seed)
+        matches, match_blobs, name_dict = load_matches(root, tmp)
+
+    env = new_env()
+    env.make_as_global()
+    results = {}
+    for name, func in (("env.rate", reference_replay), ("rate_match", replay)):
+        state = RecordState(name_dict=name_dict)
+        start = time.perf_counter()
+        func(state, matches, match_blobs, env)
+        results[name] = state
+        print(f"{name:<10} {time.perf_counter() - start:8.3f} s")
+
+    worst = max_difference(results["env.rate"], results["rate_match"])
+    ok = worst <= args.tolerance
+    print(
+        f"{len(match_blobs)} matches, max |diff| {worst:.3e} "
+        f"(tolerance {args.tolerance:.0e}) {'ok' if ok else 'NG'}"
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from teambalancer.storage import BUCKET_NAME  # noqa: E402
+
+HEADER = (
+    ",player,assists,championsKilled,goldEarned,individualPosition,minionsKilled,"
+    "neutralMinionsKilled,numDeaths,skin,team,visionWardsBoughtInGame,win\n"
+)
+POSITIONS = ["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"]
+FIRST_MATCH_ID = 358874958
+
+
+def generate_bucket(
+    root,
+    matches,
+    players=50,
+    champions=160,
+    aliases=5,
+    priorities=5,
+    seed=0,
+    bucket_name=BUCKET_NAME,
+):
+    # csv/*.csv と同じ形式の試合 CSV と設定ファイルを root/<bucket>/ に書き出す
+    # aliases 人はサブアカウント (players_name.json で本名に寄せる) でも遊ぶ
+    rng = np.random.default_rng(seed)
+    path = os.path.join(root, bucket_name)
+    os.makedirs(path, exist_ok=True)
+    skill = rng.normal(0, 1, players)
+    favorite = np.array([rng.permutation(5) for _ in range(players)])
+    names = np.array([f"player{i}" for i in range(players)], dtype=object)
+    subs = np.array([f"sub{i}" for i in range(players)], dtype=object)
+    champion_names = [f"Champion{i}" for i in range(champions)]
+
+    for n in range(matches):
+        lobby = rng.choice(players, 10, replace=False)
+        picks = rng.choice(champions, 10, replace=champions < 10)
+        use_sub = (lobby < aliases) & (rng.random(10) < 0.5)
+        gap = skill[lobby[:5]].sum() - skill[lobby[5:]].sum()
+        blue_win = rng.random() < 1 / (1 + np.exp(-gap))
+        kills = rng.integers(0, 15, 10)
+        deaths = rng.integers(0, 12, 10)
+        assists = rng.integers(0, 25, 10)
+        gold = rng.integers(5000, 20000, 10)
+        minions = rng.integers(0, 300, 10)
+        neutral = rng.integers(0, 150, 10)
+        wards = rng.integers(0, 10, 10)
+        lines = [HEADER]
+        for team, rows in ((100, range(5)), (200, range(5, 10))):
+            # 得意ポジションの順に空いている所へ入る
+            taken = set()
+            for i in rows:
+                position = next(p for p in favorite[lobby[i]] if p not in taken)
+                taken.add(position)
+                win = "Win" if blue_win == (team == 100) else "Fail"
+                player = subs[lobby[i]] if use_sub[i] else names[lobby[i]]
+                lines.append(
+                    f"{i},{player},{assists[i]},{kills[i]},{gold[i]},"
+                    f"{POSITIONS[position]},{minions[i]},{neutral[i]},{deaths[i]},"
+                    f"{champion_names[picks[i]]},{team},{wards[i]},{win}\n"
+                )
+        with open(os.path.join(path, f"{FIRST_MATCH_ID + n}.csv"), "w") as f:
+            f.writelines(lines)
+
+    name_dict = {subs[i]: names[i] for i in range(min(aliases, players))}
+    position_priority = {
+        names[i]: [int(p) + 1 for p in np.argsort(favorite[i])]
+        for i in range(min(priorities, players))
+    }
+    with open(os.path.join(path, "players_name.json"), "w", encoding="utf-8") as f:
+        json.dump(name_dict, f, ensure_ascii=False)
+    with open(os.path.join(path, "position_priority.json"), "w", encoding="utf-8") as f:
+        json.dump(position_priority, f, ensure_ascii=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダミーの試合データを作る")
+    parser.add_argument("root")
+    parser.add_argument("--matches", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--champions", type=int, default=160)
+    parser.add_argument("--aliases", type=int, default=5)
+    parser.add_argument("--priorities", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    path = generate_bucket(
+        args.root,
+        args.matches,
+        players=args.players,
+        champions=args.champions,
+        aliases=args.aliases,
+        priorities=args.priorities,
+        seed=args.seed,
+    )
+    print(f"wrote {args.matches} matches to {path}")
+
+
+if __name__ == "__main__":
+    main()
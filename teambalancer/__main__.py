@@ -0,0 +1,184 @@
+import argparse
+import json
+import math
+import sys
+import time
+
+from .balancer import LOBBY_SIZE, LOBBY_TIME_BUDGET, POSITIONS
+from .pipeline import (
+    leaderboard,
+    lobby_proposals,
+    open_snapshot,
+    rebuild,
+    team_proposals,
+)
+from .record import POSITION_IDX, new_env
+from .snapshot import SNAPSHOT_PATH
+from .storage import BUCKET_NAME, make_client
+from .timing import timings
+
+LEADERBOARD_COLUMNS = [
+    "match_count",
+    "win_rate",
+    "kda",
+    "cs",
+    "gold",
+    "rating",
+    "tier",
+]
+
+
+def client_factory(args):
+    if args.fake:
+        from .fakestorage import FakeStorageClient
+
+        return lambda: FakeStorageClient(args.fake)
+    return lambda: make_client(args.credentials)
+
+
+def cmd_rebuild(args):
+    start = time.perf_counter()
+    snapshot = rebuild(client_factory(args)(), args.bucket, args.snapshot)
+    print(
+        f"{snapshot.version[:12]}: {len(snapshot.history)} matches, "
+        f"{len(snapshot.df_player_dict)} players "
+        f"({time.perf_counter() - start:.2f}s)"
+    )
+
+
+def cmd_leaderboard(args):
+    snapshot = open_snapshot(client_factory(args), args.bucket, args.snapshot)
+    df = leaderboard(snapshot, args.position, args.kind)
+    columns = LEADERBOARD_COLUMNS
+    if args.kind == "champion":
+        columns = [c for c in columns if c not in ("rating", "tier")]
+    print(df[columns].head(args.top).to_string(float_format="{:.2f}".format))
+
+
+def print_proposal(title, proposal):
+    print(
+        f"{title} 勝敗予測 {proposal.win_probability:.0%} "
+        f"(ALL {proposal.win_probability_all:.0%}) "
+        f"平均レート {proposal.ave_rate[0]:.1f} / {proposal.ave_rate[1]:.1f}"
+    )
+    (team_a, team_b), (ranks_a, ranks_b) = proposal.teams, proposal.ranks
+    for position in POSITIONS:
+        a = f"{team_a[position]} ({ranks_a[position]})"
+        print(f"  {position:<4} {a:<24} {team_b[position]} ({ranks_b[position]})")
+
+
+def cmd_balance(args):
+    if len(args.players) % LOBBY_SIZE:
+        sys.exit(f"players must be a multiple of {LOBBY_SIZE}")
+    snapshot = open_snapshot(client_factory(args), args.bucket, args.snapshot)
+    unknown = [p for p in args.players if p not in snapshot.df_player_dict]
+    if unknown:
+        sys.exit(f"unknown players: {', '.join(unknown)}")
+    if len(args.players) > LOBBY_SIZE:
+        lobbies = lobby_proposals(
+            snapshot, args.players, args.time_budget, args.avoid_pairs
+        )
+        for i, proposal in enumerate(lobbies, 1):
+            print_proposal(f"lobby {i}", proposal)
+        return
+    proposals = team_proposals(snapshot, args.players, args.avoid_pairs)
+    for i, proposal in enumerate(proposals[: args.count], 1):
+        print_proposal(f"#{i}", proposal)
+
+
+def print_backtest_row(result):
+    params = result["params"]
+    print(
+        f"{params['sigma']:7.3f} {params['beta']:7.3f} {params['tau']:7.3f}  "
+        + "  ".join(
+            f"{s['log_loss']:8.4f} {s['brier']:7.4f} {s['ece']:6.3f}"
+            for s in (result["all"], result["position"])
+        )
+    )
+
+
+def cmd_backtest(args):
+    from .backtest import backtest, load_matches, param_grid
+
+    matches = load_matches(client_factory(args)(), args.bucket)
+    grid = param_grid(sigma=args.sigma, beta=args.beta, tau=args.tau)
+    start = time.perf_counter()
+    results = backtest(matches, grid, processes=args.processes, warmup=args.warmup)
+    print(
+        f"{len(grid)} settings x {results[0]['matches']} matches "
+        f"({time.perf_counter() - start:.1f}s)"
+    )
+    print(
+        f"{'sigma':>7} {'beta':>7} {'tau':>7}  "
+        f"{'logloss':>8} {'brier':>7} {'ece':>6}  "
+        f"{'logloss':>8} {'brier':>7} {'ece':>6}"
+    )
+    for result in results[: args.top]:
+        print_backtest_row(result)
+    # アプリで使っている設定 (new_env) の順位
+    env = new_env()
+    for rank, result in enumerate(results, 1):
+        if all(
+            math.isclose(result["params"][key], getattr(env, key))
+            for key in ("mu", "sigma", "beta", "tau")
+        ):
+            print(f"current env: rank {rank} / {len(results)}")
+            print_backtest_row(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m teambalancer")
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--credentials", help="サービスアカウントの鍵ファイル (JSON)")
+    parser.add_argument(
+        "--fake", metavar="ROOT", help="ROOT/<bucket>/ をバケットとして読む"
+    )
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH)
+    parser.add_argument("--timings", action="store_true", help="処理時間を JSON で出す")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("rebuild", help="スナップショットを作り直して保存する")
+
+    board = commands.add_parser("leaderboard", help="総合戦績を表示する")
+    board.add_argument("--position", choices=POSITION_IDX, default="ALL")
+    board.add_argument("--kind", choices=["player", "champion"], default="player")
+    board.add_argument("--top", type=int, default=20)
+
+    balance = commands.add_parser(
+        "balance", help="チーム分けを表示する (20 人以上は複数ロビーに分ける)"
+    )
+    balance.add_argument("players", nargs="+", help="10 の倍数の人数")
+    balance.add_argument("--count", type=int, default=3)
+    balance.add_argument("--time-budget", type=float, default=LOBBY_TIME_BUDGET)
+    balance.add_argument(
+        "--avoid-pairs", action="store_true", help="よく同じチームになるペアを分ける"
+    )
+
+    test = commands.add_parser(
+        "backtest",
+        help="TrueSkill のパラメータごとに全試合の勝率予測の当たり具合を比べる",
+    )
+    test.add_argument("--sigma", type=float, nargs="+")
+    test.add_argument("--beta", type=float, nargs="+")
+    test.add_argument("--tau", type=float, nargs="+")
+    test.add_argument("--processes", type=int)
+    test.add_argument("--warmup", type=int, default=0, help="採点しない最初の試合数")
+    test.add_argument("--top", type=int, default=10)
+    test.add_argument("--output", help="全結果 (較正表を含む) を JSON で書き出す")
+
+    args = parser.parse_args(argv)
+    {
+        "rebuild": cmd_rebuild,
+        "leaderboard": cmd_leaderboard,
+        "balance": cmd_balance,
+        "backtest": cmd_backtest,
+    }[args.command](args)
+    if args.timings:
+        print(timings.to_json(indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import itertools
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import trueskill
+
+from .matchstore import open_store
+from .rating import batch_cdf, rate_match
+from .record import POSITION_IDX, match_table
+from .snapshot import CSV_DIR, STORE_PATH
+from .storage import CONFIG_FILES, get_blobs, get_dataframe
+from .timing import span
+
+# 既定で試すパラメータ (trueskill の既定値 mu=25, sigma=25/3, beta=25/6, tau=25/300 を含む)
+GRID = {
+    "mu": [25.0],
+    "sigma": [4.0, 6.0, 25 / 3, 10.0, 12.0],
+    "beta": [2.0, 3.0, 25 / 6, 6.0, 8.0],
+    "tau": [0.0, 25 / 300, 0.2, 0.5],
+}
+CALIBRATION_BINS = 10
+# 予測確率を log に入れる前に丸める幅
+EPSILON = 1e-12
+ARRAYS = ["player", "position", "blue", "bounds", "blue_win"]
+
+_arrays = None
+
+
+def param_grid(**values):
+    # GRID を values で上書きし、全ての組み合わせを dict の列にする
+    grid = dict(GRID, **{k: v for k, v in values.items() if v})
+    keys = list(grid)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*grid.values())]
+
+
+def load_matches(client, bucket_name):
+    store = open_store(STORE_PATH, csv_dir=CSV_DIR)
+    blobs = list(get_blobs(bucket_name, client))
+    raw, name_dict, _ = get_dataframe(blobs, bucket_name, client, store)
+    match_blobs = [blob.name for blob in blobs if blob.name not in CONFIG_FILES]
+    return match_table(raw, name_dict, match_blobs)
+
+
+def match_arrays(matches):
+    # replay と同じ順番の試合を、プレイヤー番号などの数値配列にする
+    match = matches["match"].to_numpy()
+    player, _ = pd.factorize(matches["player"].astype(object))
+    position = pd.Index(POSITION_IDX).get_indexer(matches["position"].astype(object))
+    blue = matches["team"].to_numpy() == 100
+    win = matches["win"].to_numpy()
+    bounds = np.r_[0, np.flatnonzero(np.diff(match)) + 1, len(matches)]
+    # 各試合の最後の行の勝敗から、青チーム (100) が勝ったかを求める
+    last = bounds[1:] - 1
+    return {
+        "player": player.astype(np.int32),
+        "position": position.astype(np.int8),
+        "blue": blue,
+        "bounds": bounds.astype(np.int64),
+        "blue_win": win[last] == blue[last],
+    }
+
+
+def save_arrays(arrays, directory):
+    for name in ARRAYS:
+        np.save(os.path.join(directory, f"{name}.npy"), arrays[name])
+
+
+def load_arrays(directory):
+    # メモリマップで開くので、全ワーカーが同じページキャッシュを読む
+    return {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in ARRAYS
+    }
+
+
+def replay_predictions(arrays, params):
+    # params の環境で全試合をレート計算し、各試合前の青チームの勝率予測を返す
+    # (ALL のレートによる予測と、ポジション別のレートによる予測)
+    env = trueskill.TrueSkill(draw_probability=0.0, **params)
+    cdf = batch_cdf(env)
+    player = np.asarray(arrays["player"])
+    position = np.asarray(arrays["position"])
+    blue = np.asarray(arrays["blue"])
+    bounds = np.asarray(arrays["bounds"])
+    blue_win = np.asarray(arrays["blue_win"])
+    n_players = int(player.max()) + 1 if len(player) else 0
+    mu = np.full((n_players, len(POSITION_IDX)), env.mu)
+    sigma = np.full((n_players, len(POSITION_IDX)), env.sigma)
+    predictions = np.empty((len(bounds) - 1, 2))
+    for k in range(len(bounds) - 1):
+        rows = slice(bounds[k], bounds[k + 1])
+        p = player[rows]
+        chains = (
+            np.broadcast_to(p, (2, len(p))),
+            np.stack([np.zeros_like(p), position[rows]]),
+        )
+        m, s = mu[chains], sigma[chains]
+        side = np.where(blue[rows], 1.0, -1.0)
+        # win_probability と同じ式 (tau は含めない)
+        denom = np.sqrt(len(p) * env.beta**2 + (s**2).sum(axis=1))
+        predictions[k] = cdf((m * side).sum(axis=1) / denom)
+        m, s = rate_match(m, s, side if blue_win[k] else -side, env=env)
+        mu[chains], sigma[chains] = m, s
+    return predictions, blue_win
+
+
+def scores(p, y, bins=CALIBRATION_BINS):
+    # log-loss, Brier スコア, 較正 (予測確率の区間ごとの予測平均と実際の勝率)
+    y = np.asarray(y, dtype=float)
+    clipped = np.clip(p, EPSILON, 1 - EPSILON)
+    log_loss = -np.mean(y * np.log(clipped) + (1 - y) * np.log(1 - clipped))
+    brier = np.mean((p - y) ** 2)
+    bucket = np.minimum((p * bins).astype(int), bins - 1)
+    count = np.bincount(bucket, minlength=bins)
+    with np.errstate(invalid="ignore"):
+        predicted = np.bincount(bucket, weights=p, minlength=bins) / count
+        observed = np.bincount(bucket, weights=y, minlength=bins) / count
+    ece = np.nansum(count * np.abs(predicted - observed)) / max(len(p), 1)
+    return {
+        "log_loss": float(log_loss),
+        "brier": float(brier),
+        "ece": float(ece),
+        "calibration": [
+            {
+                "low": i / bins,
+                "high": (i + 1) / bins,
+                "count": int(count[i]),
+                "predicted": None if math.isnan(predicted[i]) else float(predicted[i]),
+                "observed": None if math.isnan(observed[i]) else float(observed[i]),
+            }
+            for i in range(bins)
+        ],
+    }
+
+
+def _init_worker(directory):
+    global _arrays
+    _arrays = load_arrays(directory)
+
+
+def _evaluate(params, warmup, arrays=None):
+    predictions, y = replay_predictions(_arrays if arrays is None else arrays, params)
+    predictions, y = predictions[warmup:], y[warmup:]
+    return {
+        "params": params,
+        "matches": len(y),
+        "all": scores(predictions[:, 0], y),
+        "position": scores(predictions[:, 1], y),
+    }
+
+
+def backtest(matches, grid, processes=None, warmup=0):
+    # grid の各点で全試合を再計算し、ALL レートでの log-loss が小さい順に返す
+    arrays = match_arrays(matches)
+    with span("backtest.run"):
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            results = [_evaluate(params, warmup, arrays) for params in grid]
+        else:
+            # 試合データは 1 度だけファイルに書き、各ワーカーはそれをメモリマップで読む
+            with tempfile.TemporaryDirectory() as directory:
+                save_arrays(arrays, directory)
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    initializer=_init_worker,
+                    initargs=(directory,),
+                ) as pool:
+                    chunksize = max(1, len(grid) // (4 * processes))
+                    results = list(
+                        pool.map(
+                            _evaluate,
+                            grid,
+                            itertools.repeat(warmup),
+                            chunksize=chunksize,
+                        )
+                    )
+    return sorted(results, key=lambda result: result["all"]["log_loss"])
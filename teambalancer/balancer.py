@@ -0,0 +1,266 @@
+import itertools
+import random
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import trueskill
+
+from .rating import win_probability_batch
+from .timing import count
+
+POSITIONS = ["TOP", "JNG", "MID", "BOT", "SUP"]
+ROLE_PERMUTATIONS = np.array(list(itertools.permutations(range(len(POSITIONS)))))
+# 希望順位 1 つ分をレート何点分とみなすか
+# 第 1 希望と第 2 希望の控えめなレート (mu - 3 sigma) の差は 9 割のプレイヤーで 10 点未満なので、
+# それより大きく差がつくときだけ低い希望のポジションを選ぶ
+RANK_WEIGHT = 10.0
+# 上位何位までの希望ポジションに割り当てるか (誰かを割り当てられなければ 1 つずつ広げる)
+RANK_THRESHOLD = 2
+# よく同じチームになるペアを避けるとき、同じチームのペアの同席率 (0-1) 1 あたり
+# 勝率の偏り何ポイント分とみなすか (いつも組んでいるペアで 5%)
+PAIR_WEIGHT = 0.05
+# ALL のレートでの勝率が 50% からこれ以内の分け方だけを使う (無ければ入るところまで広げる)
+WP_ALL_BAND = 0.1
+# 提示するチーム分けの数 (互いに 2 人以上の入れ替えで異なるもの)
+TOP_K = 10
+# 最良の案よりスコア (50% からの勝率の差) がこれ以上悪い分け方は提示しない
+PROPOSAL_SPREAD = 0.1
+LOBBY_SIZE = 10
+# 複数ロビーの入れ替え探索に使う時間 (秒)
+LOBBY_TIME_BUDGET = 2.0
+# 最も偏ったロビーの勝率がこれ以内に 50% に近づいたら探索をやめる
+LOBBY_TOLERANCE = 0.001
+
+
+@dataclass(frozen=True)
+class Proposal:
+    teams: tuple
+    win_probability: float
+    win_probability_all: float
+    ave_rate: tuple
+    # teams と同じ形で、各ポジションが何番目の希望か (1 が第 1 希望)
+    ranks: tuple
+
+
+def position_order(player, position_priority, df_player_dict):
+    # 希望ポジションの順番 (POSITIONS のインデックス)
+    tmp_list = [0, 1, 2, 3, 4]
+    if player in position_priority:
+        return [i for _, i in sorted(zip(position_priority[player], tmp_list))]
+    role_weight = list(df_player_dict[player]["match_count"][:])
+    weight_list = [role_weight[i + 1] / role_weight[0] for i in range(5)]
+    return [i for _, i in sorted(zip(weight_list, tmp_list), reverse=True)]
+
+
+def preference_ranks(players, orders):
+    # (プレイヤー, ポジション) ごとの希望順位 (0 が第 1 希望)
+    rank = np.empty((len(players), len(POSITIONS)), dtype=int)
+    for i, player in enumerate(players):
+        rank[i, orders[player]] = np.arange(len(POSITIONS))
+    return rank
+
+
+def role_costs(rank, mu, sigma, threshold=len(POSITIONS)):
+    # (プレイヤー, ポジション) ごとのコスト
+    # 希望順位が高いほど、そのポジションの控えめなレート (mu - 3 sigma) が高いほど小さい
+    # (未経験のポジションは sigma が大きいので初期値の mu でも選ばれにくい)
+    # 希望順位が threshold 位より下のポジションには割り当てない
+    costs = RANK_WEIGHT * rank - (mu - 3 * sigma)
+    return np.where(rank < threshold, costs, np.inf)
+
+
+def assign_roles(costs, teams):
+    # teams: (チーム数, 5) のプレイヤー番号
+    # 各チームで合計コストが最小になるポジション割り当てを 120 通りの全順列から選び、
+    # その割り当てと合計コスト (割り当てられなければ inf) を返す
+    total = costs[teams[:, None, :], ROLE_PERMUTATIONS[None, :, :]].sum(axis=-1)
+    best = total.argmin(axis=1)
+    return ROLE_PERMUTATIONS[best], total[np.arange(len(teams)), best]
+
+
+def pair_penalty(together, teams):
+    # 各チームに含まれるペアの同席率 (一緒に出た試合数 / 2 人のうち少ない方の試合数) の合計
+    games = np.diag(together)
+    rate = together / np.maximum(np.minimum.outer(games, games), 1)
+    np.fill_diagonal(rate, 0)
+    return rate[teams[:, :, None], teams[:, None, :]].sum(axis=(1, 2)) / 2
+
+
+def diverse(order, members, top_k):
+    # order の順に見て、選び済みのどの分け方とも 2 人以上入れ替わっているものだけ残す
+    # members: (分け方, プレイヤー) の bool 行列 (チームAに入っていれば True)
+    team_size = members.sum(axis=1).max()
+    chosen = []
+    for row in order:
+        if len(chosen) >= top_k:
+            break
+        if chosen:
+            # チームA同士の共通人数が team_size - 1 か、(A と B を入れ替えて見て)
+            # 1 なら 1 人の入れ替えで移れる
+            common = (members[chosen] & members[row]).sum(axis=1)
+            if (np.minimum(common, team_size - common) <= 1).any():
+                continue
+        chosen.append(row)
+    return chosen
+
+
+def balance_teams(
+    players,
+    ratings,
+    orders,
+    env=None,
+    top_k=TOP_K,
+    pairs=None,
+    pair_weight=PAIR_WEIGHT,
+):
+    # pairs (PairStats) を渡すと、よく同じチームになるペアを分ける方を優先する
+    env = env if env else trueskill.global_env()
+    players = sorted(players)
+    # (プレイヤー, ALL + 各ポジション) の mu / sigma
+    mu, sigma = ratings.current(players, ["ALL"] + POSITIONS)
+    idx = range(len(players))
+    teams = np.array(list(itertools.combinations(idx, len(players) // 2)))
+    # 先頭のプレイヤーを含む組み合わせをチームA、その残りをチームBとする
+    index = {team: i for i, team in enumerate(map(tuple, teams))}
+    split_a = np.flatnonzero(teams[:, 0] == 0)
+    split_b = np.array(
+        [index[tuple(i for i in idx if i not in teams[a])] for a in split_a]
+    )
+    # 5 人の組み合わせごとに最適なポジション割り当てを求めておく
+    # 両チームとも全員を上位 RANK_THRESHOLD 位までの希望に割り当てられる分け方だけを使い、
+    # そういう分け方が無ければ希望の範囲を 1 つずつ広げる
+    rank = preference_ranks(players, orders)
+    for threshold in range(RANK_THRESHOLD, len(POSITIONS) + 1):
+        costs = role_costs(rank, mu[:, 1:], sigma[:, 1:], threshold)
+        roles, cost = assign_roles(costs, teams)
+        feasible = np.isfinite(cost[split_a]) & np.isfinite(cost[split_b])
+        if feasible.any():
+            break
+    count("balancer.runs")
+    count("balancer.splits", len(split_a))
+    count("balancer.assignments", len(teams) * len(ROLE_PERMUTATIONS))
+
+    team_a, team_b = teams[split_a], teams[split_b]
+    roles_a, roles_b = roles[split_a] + 1, roles[split_b] + 1
+    wp_all = win_probability_batch(
+        mu[team_a, 0], sigma[team_a, 0], mu[team_b, 0], sigma[team_b, 0], env
+    )
+    wp = win_probability_batch(
+        mu[team_a, roles_a],
+        sigma[team_a, roles_a],
+        mu[team_b, roles_b],
+        sigma[team_b, roles_b],
+        env,
+    )
+    score = np.abs(wp - 0.5)
+    if pairs is not None:
+        penalty = pair_penalty(pairs.submatrix("together", players), teams)
+        score = score + pair_weight * (penalty[split_a] + penalty[split_b])
+    # ALL のレートでの勝率が 40-60% に入る分け方のうち、勝率が 50% に近いものから順に並べる
+    gap_all = np.abs(wp_all - 0.5)
+    allowed = feasible & (gap_all <= max(WP_ALL_BAND, gap_all[feasible].min()))
+    best = np.lexsort((gap_all, score))
+    best = best[allowed[best]]
+    best = best[score[best] <= score[best[0]] + PROPOSAL_SPREAD]
+    members = np.zeros((len(split_a), len(players)), dtype=bool)
+    np.put_along_axis(members, team_a, True, axis=1)
+
+    proposals = []
+    for row in diverse(best, members, top_k):
+        lineups, team_ranks = [], []
+        for team, team_roles in ((team_a, roles_a), (team_b, roles_b)):
+            slots = sorted(zip(team_roles[row], team[row]))
+            lineups.append({POSITIONS[pos - 1]: players[i] for pos, i in slots})
+            team_ranks.append(
+                {POSITIONS[pos - 1]: int(rank[i, pos - 1]) + 1 for pos, i in slots}
+            )
+        proposals.append(
+            Proposal(
+                teams=tuple(lineups),
+                win_probability=float(wp[row]),
+                win_probability_all=float(wp_all[row]),
+                ave_rate=(
+                    float(mu[team_a[row], roles_a[row]].mean()),
+                    float(mu[team_b[row], roles_b[row]].mean()),
+                ),
+                ranks=tuple(team_ranks),
+            )
+        )
+    return proposals
+
+
+def balance_lobbies(
+    players,
+    ratings,
+    orders,
+    env=None,
+    time_budget=LOBBY_TIME_BUDGET,
+    seed=0,
+    pairs=None,
+):
+    # 10 人ずつのロビーに分け、最も偏ったロビーの勝率が 50% に近くなるよう
+    # ロビー間で 2 人を入れ替える局所探索を時間の許す限り続ける
+    players = sorted(players)
+    if len(players) % LOBBY_SIZE:
+        raise ValueError(f"players must be a multiple of {LOBBY_SIZE}")
+    deadline = time.monotonic() + time_budget
+    cache = {}
+
+    def best(lobby):
+        key = frozenset(lobby)
+        if key not in cache:
+            count("balancer.lobby_evaluations")
+            cache[key] = balance_teams(
+                list(lobby), ratings, orders, env, top_k=1, pairs=pairs
+            )[0]
+        return cache[key]
+
+    def score(lobby):
+        return abs(best(lobby).win_probability - 0.5)
+
+    def cost(lobbies):
+        # 偏りの大きい順に並べて辞書式に比べる (まず最悪のロビーを良くする)
+        return sorted((score(lobby) for lobby in lobbies), reverse=True)
+
+    # レート順に蛇行して配り、各ロビーの強さを揃えた状態から始める
+    n = len(players) // LOBBY_SIZE
+    mu, _ = ratings.current(players, ["ALL"])
+    lobbies = [[] for _ in range(n)]
+    for rank, i in enumerate(np.argsort(-mu[:, 0], kind="stable")):
+        lap, j = divmod(rank, n)
+        lobbies[j if lap % 2 == 0 else n - 1 - j].append(players[i])
+
+    rng = random.Random(seed)
+    current = cost(lobbies)
+    improved = n > 1
+    while improved and current[0] > LOBBY_TOLERANCE and time.monotonic() < deadline:
+        improved = False
+        worst = max(range(n), key=lambda k: score(lobbies[k]))
+        swaps = [
+            (a, other, b)
+            for a in range(LOBBY_SIZE)
+            for other in range(n)
+            if other != worst
+            for b in range(LOBBY_SIZE)
+        ]
+        rng.shuffle(swaps)
+        for a, other, b in swaps:
+            if time.monotonic() >= deadline:
+                break
+            candidate = [list(lobby) for lobby in lobbies]
+            candidate[worst][a], candidate[other][b] = (
+                lobbies[other][b],
+                lobbies[worst][a],
+            )
+            candidate_cost = cost(candidate)
+            if candidate_cost < current:
+                count("balancer.lobby_swaps")
+                lobbies, current, improved = candidate, candidate_cost, True
+                break
+
+    return sorted(
+        (best(lobby) for lobby in lobbies),
+        key=lambda proposal: abs(proposal.win_probability - 0.5),
+        reverse=True,
+    )
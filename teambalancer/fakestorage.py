@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+
+
+class FakeBlob:
+    def __init__(self, client, bucket_name, name):
+        self._client = client
+        self._path = os.path.join(client.root, bucket_name, name)
+        self.name = name
+        if os.path.isfile(self._path):
+            stat = os.stat(self._path)
+            self.generation = stat.st_mtime_ns
+            self.size = stat.st_size
+            with open(self._path, "rb") as f:
+                self.md5_hash = base64.b64encode(
+                    hashlib.md5(f.read()).digest()
+                ).decode()
+
+    def download_as_bytes(self, **kwargs):
+        return self._client._download(self)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self._client, self.name, name)
+
+
+class FakeStorageClient:
+    # google.cloud.storage.Client の代わりにローカルの root/<bucket>/<blob> を読む
+    # latency で通信の往復時間を、failures で一時的なエラーを再現できる
+    def __init__(self, root, latency=0.0, failures=None):
+        self.root = root
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.download_count = 0
+        self._lock = threading.Lock()
+
+    def list_blobs(self, bucket_name):
+        time.sleep(self.latency)
+        names = sorted(os.listdir(os.path.join(self.root, bucket_name)))
+        return [FakeBlob(self, bucket_name, name) for name in names]
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self, bucket_name)
+
+    def _download(self, blob):
+        time.sleep(self.latency)
+        with self._lock:
+            self.download_count += 1
+            if self.failures.get(blob.name, 0) > 0:
+                self.failures[blob.name] -= 1
+                raise ConnectionError(f"fake failure: {blob.name}")
+        with open(blob._path, "rb") as f:
+            return f.read()
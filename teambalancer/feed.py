@@ -0,0 +1,212 @@
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+from .fileio import atomic_write, locked
+
+FEED_VERSION = 1
+FEED_PATH = "benzaiten"
+LEGACY_TEXT_PATH = "benzaiten.txt"
+LEGACY_IMAGES_PATH = "images.txt"
+
+# 投稿ごとの索引 (id、ログ内の位置と長さ、削除済みかどうか)
+# id は投稿順に増える通し番号で、詰め直しても変わらない
+INDEX_DTYPE = np.dtype(
+    [("id", "<i8"), ("offset", "<i8"), ("length", "<i4"), ("deleted", "u1")]
+)
+# 削除済みがこの件数以上、かつ全体のこの割合以上になったらログを詰め直す
+COMPACT_MIN = 20
+COMPACT_RATIO = 0.5
+
+LEGACY_LINE = re.compile(r"^\[(.*?)\]\s*(.*)$")
+
+
+def _empty_meta(generation=0, next_id=0):
+    return {
+        "version": FEED_VERSION,
+        "generation": generation,
+        "next_id": next_id,
+        "posts": 0,
+        "deleted": 0,
+        "log_size": 0,
+    }
+
+
+class Feed:
+    # 投稿を 1 行 1 件の JSON ログ (posts.<世代>.log) に追記し、index.<世代>.bin で位置を引く
+    # 削除はログに {"delete": id} を追記して索引に印を付けるだけで、
+    # 削除済みが溜まったら次の世代のファイルに生きている投稿だけを書き直す
+    # meta.json の世代と posts (索引の件数) / log_size までが確定した内容
+    def __init__(self, path=FEED_PATH):
+        self.path = path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _log(self, meta):
+        return self._file(f"posts.{meta['generation']}.log")
+
+    def _index_file(self, meta):
+        return self._file(f"index.{meta['generation']}.bin")
+
+    def meta(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = None
+        if not meta or meta.get("version") != FEED_VERSION:
+            meta = _empty_meta()
+        return meta
+
+    def _write_meta(self, meta):
+        atomic_write(self._file("meta.json"), json.dumps(meta))
+
+    def _lock(self, exclusive=True):
+        # 読み込みも共有ロックを取る (詰め直しで消える古い世代を読まないため)
+        return locked(self._file("lock"), exclusive)
+
+    def _index(self, meta):
+        if not meta["posts"]:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(
+            self._index_file(meta), dtype=INDEX_DTYPE, mode="r", shape=(meta["posts"],)
+        )
+
+    def __len__(self):
+        meta = self.meta()
+        return meta["posts"] - meta["deleted"]
+
+    def _append(self, meta, records):
+        # records を追記して meta を進める (meta.json は呼び出し側で書く)
+        # 途中で失敗した追記の残りは確定済みの長さで切り捨ててから書く
+        index = []
+        with open(self._log(meta), "ab") as f:
+            f.truncate(meta["log_size"])
+            offset = meta["log_size"]
+            for record in records:
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+                f.write(line)
+                if "delete" not in record:
+                    index.append((record["id"], offset, len(line), 0))
+                offset += len(line)
+        with open(self._index_file(meta), "ab") as f:
+            f.truncate(meta["posts"] * INDEX_DTYPE.itemsize)
+            f.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+        meta["posts"] += len(index)
+        meta["log_size"] = offset
+
+    def post(self, time, text, image):
+        with self._lock():
+            meta = self.meta()
+            post_id = meta["next_id"]
+            self._append(
+                meta, [{"id": post_id, "time": time, "text": text, "image": image}]
+            )
+            meta["next_id"] = post_id + 1
+            self._write_meta(meta)
+            return post_id
+
+    def delete(self, post_id):
+        with self._lock():
+            meta = self.meta()
+            index = self._index(meta)
+            slot = int(np.searchsorted(index["id"], post_id))
+            if slot >= len(index) or index[slot]["id"] != post_id:
+                return False
+            if index[slot]["deleted"]:
+                return False
+            self._append(meta, [{"delete": post_id}])
+            # 索引の削除フラグだけをその場で書き換える
+            with open(self._index_file(meta), "r+b") as f:
+                f.seek(slot * INDEX_DTYPE.itemsize + INDEX_DTYPE.fields["deleted"][1])
+                f.write(b"\x01")
+            meta["deleted"] += 1
+            self._write_meta(meta)
+            if (
+                meta["deleted"] >= COMPACT_MIN
+                and meta["deleted"] >= COMPACT_RATIO * meta["posts"]
+            ):
+                self._compact(meta)
+            return True
+
+    def compact(self):
+        with self._lock():
+            self._compact(self.meta())
+
+    def _compact(self, meta):
+        # 生きている投稿だけを次の世代に書き、meta.json の差し替えで切り替える
+        live = np.flatnonzero(self._index(meta)["deleted"] == 0)
+        records = self._read(meta, live)
+        new_meta = _empty_meta(meta["generation"] + 1, meta["next_id"])
+        for path in (self._log(new_meta), self._index_file(new_meta)):
+            open(path, "wb").close()
+        self._append(new_meta, records)
+        self._write_meta(new_meta)
+        self._remove_old(new_meta)
+
+    def _remove_old(self, meta):
+        keep = {self._log(meta), self._index_file(meta)}
+        for pattern in ("posts.*.log", "index.*.bin"):
+            for path in glob.glob(self._file(pattern)):
+                if path not in keep:
+                    os.remove(path)
+
+    def _read(self, meta, slots):
+        index = self._index(meta)
+        records = []
+        with open(self._log(meta), "rb") as f:
+            for slot in slots:
+                _, offset, length, _ = index[slot]
+                f.seek(offset)
+                records.append(json.loads(f.read(length)))
+        return records
+
+    def page(self, page, page_size):
+        # 新しい順に page 番目 (0 始まり) の投稿と、残っている投稿の総数
+        # ログは表示する分だけ読む
+        with self._lock(exclusive=False):
+            meta = self.meta()
+            live = np.flatnonzero(self._index(meta)["deleted"] == 0)[::-1]
+            start = page * page_size
+            end = start + page_size
+            return self._read(meta, live[start:end]), len(live)
+
+
+def import_legacy(feed, text_path=LEGACY_TEXT_PATH, images_path=LEGACY_IMAGES_PATH):
+    # 旧形式 (新しい順に 1 行 1 件の benzaiten.txt と images.txt) を古い順に取り込む
+    # 一度でも投稿 (取り込み) した feed には取り込まない
+    # (全件削除して詰め直した後も next_id は残るので、消した投稿が戻ったり id が重なったりしない)
+    with open(text_path, encoding="utf-8") as f:
+        lines = [line.rstrip("\n") for line in f]
+    with open(images_path, encoding="utf-8") as f:
+        images = [line.strip() for line in f]
+    records = []
+    for line, image in reversed(list(zip(lines, images))):
+        match = LEGACY_LINE.match(line)
+        time, text = match.groups() if match else ("", line)
+        records.append({"id": len(records), "time": time, "text": text, "image": image})
+    with feed._lock():
+        meta = feed.meta()
+        if meta["next_id"]:
+            return 0
+        feed._append(meta, records)
+        meta["next_id"] = max(meta["next_id"], len(records))
+        feed._write_meta(meta)
+    return len(records)
+
+
+def open_feed(path=FEED_PATH, legacy=True):
+    # まだ一度も投稿されていなければ旧形式のファイルから取り込んで開く
+    feed = Feed(path)
+    if legacy and not feed.meta()["next_id"] and os.path.isfile(LEGACY_TEXT_PATH):
+        import_legacy(feed)
+    return feed
+
+
+if __name__ == "__main__":
+    # python -m teambalancer.feed  (旧形式のファイルを取り込む)
+    print(f"imported {import_legacy(Feed())} posts")
@@ -0,0 +1,41 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def locked(path, exclusive=True):
+    # path をロックファイルにして、書き込みは排他、読み込みは共有ロックを取る
+    # (fcntl の無い環境ではロックしない)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data):
+    # 一時ファイルに書いてから置き換え、読み手には古い内容か新しい内容のどちらかだけを見せる
+    # data は bytes か str (str は UTF-8 で書く)
+    # 一時ファイル名は書き手ごとに変える (同じプロセスの別スレッドが同じ path に書くことがある)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    try:
+        with open(tmp_path, "xb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,68 @@
+import json
+from dataclasses import dataclass
+
+from .fileio import atomic_write
+
+MANIFEST_VERSION = 1
+
+
+def blob_entry(blob):
+    # 一覧に含まれる情報だけで中身の変化を見分ける (ダウンロードはしない)
+    generation = getattr(blob, "generation", None)
+    return {
+        "generation": None if generation is None else str(generation),
+        "md5": getattr(blob, "md5_hash", None),
+        "size": getattr(blob, "size", None),
+    }
+
+
+def fingerprint(entry):
+    # md5 があればそれ、無ければ世代とサイズで内容を表す
+    return entry["md5"] or f"{entry['generation']}:{entry['size']}"
+
+
+@dataclass(frozen=True)
+class ManifestDiff:
+    added: tuple
+    changed: tuple
+    removed: tuple
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class Manifest:
+    # 前回取り込んだ時点の blob 名 -> (世代, md5, サイズ)
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        if data.get("version") != MANIFEST_VERSION:
+            return cls()
+        return cls(data["entries"])
+
+    def save(self, path):
+        atomic_write(
+            path, json.dumps({"version": MANIFEST_VERSION, "entries": self.entries})
+        )
+
+    def diff(self, blobs):
+        current = {blob.name: blob_entry(blob) for blob in blobs}
+        added = tuple(name for name in current if name not in self.entries)
+        changed = tuple(
+            name
+            for name, entry in current.items()
+            if name in self.entries
+            and fingerprint(entry) != fingerprint(self.entries[name])
+        )
+        removed = tuple(name for name in self.entries if name not in current)
+        return ManifestDiff(added, changed, removed)
+
+    def update(self, blobs):
+        self.entries = {blob.name: blob_entry(blob) for blob in blobs}
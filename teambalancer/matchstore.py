@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .fileio import atomic_write, locked
+
+STORE_VERSION = 1
+
+# 列名: 型 (category はコードを int32 で保存し、カテゴリ名は meta.json に持つ)
+COLUMNS = {
+    "match_id": "category",
+    "player": "category",
+    "skin": "category",
+    "individualPosition": "category",
+    "win": "category",
+    "team": "int16",
+    "assists": "int32",
+    "championsKilled": "int32",
+    "goldEarned": "int32",
+    "minionsKilled": "int32",
+    "neutralMinionsKilled": "int32",
+    "numDeaths": "int32",
+    "visionWardsBoughtInGame": "int32",
+    "cs": "int32",
+    "kda": "float64",
+}
+CODE_DTYPE = "int32"
+# 差し替えで不要になった行がこれだけ溜まったら、生きている行だけのファイルに詰め直す
+COMPACT_DEAD = 100
+
+
+def _dtype(column):
+    return np.dtype(CODE_DTYPE if COLUMNS[column] == "category" else COLUMNS[column])
+
+
+def derive_columns(df):
+    df = df.copy()
+    df["cs"] = df["minionsKilled"] + df["neutralMinionsKilled"]
+    kill_assist = df["championsKilled"] + df["assists"]
+    df["kda"] = kill_assist / df["numDeaths"].where(df["numDeaths"] != 0, 1)
+    return df
+
+
+class MatchStore:
+    # 全試合を 1 列 1 ファイルの固定長バイナリに追記していく
+    # meta.json の rows までが確定した行で、読み込みは列ごとの mmap のみ
+    # 中身が差し替わった試合は新しい行を追記し、古い行の番号を meta.json の dead に残す
+    # dead が溜まったら次の世代のファイルに生きている行だけを書き直す
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def meta(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = None
+        if not meta or meta.get("version") != STORE_VERSION:
+            meta = {
+                "version": STORE_VERSION,
+                "rows": 0,
+                "categories": {c: [] for c, t in COLUMNS.items() if t == "category"},
+            }
+        return meta
+
+    @property
+    def matches(self):
+        return self.meta()["categories"]["match_id"]
+
+    def __len__(self):
+        return self.meta()["rows"]
+
+    def __contains__(self, match_id):
+        return match_id in set(self.matches)
+
+    def _lock(self, exclusive=True):
+        # 読み込みも mmap を開くまで共有ロックを取る (詰め直しで消える古い世代を開かないため)
+        return locked(self._file("lock"), exclusive)
+
+    def _column_file(self, column, meta):
+        # 最初の世代は世代番号なしのファイル名
+        generation = meta.get("generation", 0)
+        if not generation:
+            return self._file(f"{column}.bin")
+        return self._file(f"{column}.{generation}.bin")
+
+    def _column(self, column, meta):
+        if not meta["rows"]:
+            return np.empty(0, dtype=_dtype(column))
+        return np.memmap(
+            self._column_file(column, meta),
+            dtype=_dtype(column),
+            mode="r",
+            shape=(meta["rows"],),
+        )
+
+    def append(self, df_dict, replace=()):
+        # df_dict: {試合 ID (blob 名): 試合の DataFrame}
+        # 既に入っている試合は無視する (replace に含まれる試合は古い行と入れ替える)
+        with self._lock():
+            meta = self.meta()
+            known = set(meta["categories"]["match_id"])
+            replace = set(replace) & known & set(df_dict)
+            frames = [
+                df.assign(match_id=match_id)
+                for match_id, df in df_dict.items()
+                if match_id not in known or match_id in replace
+            ]
+            if not frames:
+                return 0
+            df = derive_columns(pd.concat(frames, ignore_index=True))
+            rows = meta["rows"]
+            if replace and rows:
+                categories = meta["categories"]["match_id"]
+                codes = [
+                    i for i, match_id in enumerate(categories) if match_id in replace
+                ]
+                dead = np.flatnonzero(np.isin(self._column("match_id", meta), codes))
+                meta["dead"] = sorted(set(meta.get("dead", [])) | set(dead.tolist()))
+            for column, dtype in COLUMNS.items():
+                if dtype == "category":
+                    categories = meta["categories"][column]
+                    index = {value: code for code, value in enumerate(categories)}
+                    values = df[column].astype(str)
+                    for value in pd.unique(values):
+                        if value not in index:
+                            index[value] = len(categories)
+                            categories.append(value)
+                    data = values.map(index).to_numpy(dtype=CODE_DTYPE)
+                else:
+                    data = df[column].to_numpy(dtype=dtype)
+                with open(self._column_file(column, meta), "ab") as f:
+                    # 途中で失敗した追記の残りを切り捨ててから書く
+                    f.truncate(rows * _dtype(column).itemsize)
+                    f.write(np.ascontiguousarray(data).tobytes())
+            meta["rows"] = rows + len(df)
+            self._write_meta(meta)
+            if len(meta.get("dead", [])) >= COMPACT_DEAD:
+                self._compact(meta)
+            return len(frames)
+
+    def _write_meta(self, meta):
+        atomic_write(self._file("meta.json"), json.dumps(meta, ensure_ascii=False))
+
+    def compact(self):
+        with self._lock():
+            self._compact(self.meta())
+
+    def _compact(self, meta):
+        # 生きている行だけを次の世代に書き、meta.json の差し替えで切り替える
+        live = np.ones(meta["rows"], dtype=bool)
+        live[meta.get("dead", [])] = False
+        new_meta = dict(
+            meta,
+            generation=meta.get("generation", 0) + 1,
+            rows=int(live.sum()),
+            dead=[],
+        )
+        for column in COLUMNS:
+            data = np.ascontiguousarray(self._column(column, meta)[live])
+            atomic_write(self._column_file(column, new_meta), data.tobytes())
+        self._write_meta(new_meta)
+        keep = {self._column_file(column, new_meta) for column in COLUMNS}
+        for path in glob.glob(self._file("*.bin")):
+            if path not in keep:
+                os.remove(path)
+
+    def read(self):
+        with self._lock(exclusive=False):
+            meta = self.meta()
+            columns = {column: self._column(column, meta) for column in COLUMNS}
+        data = {}
+        for column, dtype in COLUMNS.items():
+            if dtype == "category":
+                data[column] = pd.Categorical.from_codes(
+                    columns[column], categories=meta["categories"][column]
+                )
+            else:
+                data[column] = columns[column]
+        # copy=False で列ごとのブロックのまま持ち、mmap をコピーしない
+        df = pd.DataFrame(data, copy=False)
+        dead = meta.get("dead")
+        if dead:
+            df = df.drop(index=dead).reset_index(drop=True)
+        return df
+
+
+def import_csv_dir(csv_dir, store):
+    # 旧形式の csv/<試合 ID>.csv をまとめて取り込む
+    df_dict = {}
+    for file_path in sorted(glob.glob(os.path.join(csv_dir, "*.csv"))):
+        df = pd.read_csv(file_path)
+        df = df.drop(columns=[c for c in df.columns if c.startswith("Unnamed")])
+        df_dict[os.path.basename(file_path)] = df
+    return store.append(df_dict)
+
+
+def open_store(path, csv_dir=None):
+    store = MatchStore(path)
+    if csv_dir and not len(store) and os.path.isdir(csv_dir):
+        import_csv_dir(csv_dir, store)
+    return store
+
+
+if __name__ == "__main__":
+    # python -m teambalancer.matchstore csv cache/matches
+    count = import_csv_dir(sys.argv[1], MatchStore(sys.argv[2]))
+    print(f"imported {count} matches")
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+MATRICES = ["together", "together_wins", "against", "against_wins"]
+
+
+class PairStats:
+    # プレイヤー同士の成績を (プレイヤー番号, プレイヤー番号) の行列で持ち、試合ごとに加算する
+    # together[i, j]: 同じチームで戦った試合数 (対角は i 自身の試合数)
+    # together_wins[i, j]: そのうち勝った試合数
+    # against[i, j]: 敵同士で戦った試合数
+    # against_wins[i, j]: そのうち i が勝った試合数
+    def __init__(self, capacity=64):
+        self._index = {}
+        self._players = []
+        for name in MATRICES:
+            setattr(self, name, np.zeros((capacity, capacity), dtype=np.int32))
+
+    def __contains__(self, player):
+        return player in self._index
+
+    def __len__(self):
+        return len(self._players)
+
+    def _grow(self, size):
+        capacity = len(self.together)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in MATRICES:
+            old = getattr(self, name)
+            new = np.zeros((capacity, capacity), dtype=old.dtype)
+            new[: len(old), : len(old)] = old
+            setattr(self, name, new)
+
+    def ids(self, players, add=False):
+        if add:
+            for player in players:
+                if player not in self._index:
+                    self._index[player] = len(self._players)
+                    self._players.append(player)
+            self._grow(len(self._players))
+        return np.array([self._index[player] for player in players], dtype=np.intp)
+
+    def add_match(self, winners, losers):
+        win = self.ids(winners, add=True)
+        lose = self.ids(losers, add=True)
+        for team in (win, lose):
+            self.together[np.ix_(team, team)] += 1
+        self.together_wins[np.ix_(win, win)] += 1
+        self.against[np.ix_(win, lose)] += 1
+        self.against[np.ix_(lose, win)] += 1
+        self.against_wins[np.ix_(win, lose)] += 1
+
+    def lookup(self, a, b):
+        i, j = self.ids([a, b])
+        return {name: int(getattr(self, name)[i, j]) for name in MATRICES}
+
+    def submatrix(self, name, players):
+        ids = self.ids(players)
+        return getattr(self, name)[np.ix_(ids, ids)]
+
+    def partners(self, player):
+        # player と同じチーム・敵チームで戦った相手ごとの成績
+        i = self._index[player]
+        n = len(self._players)
+        df = pd.DataFrame(
+            {name: getattr(self, name)[i, :n] for name in MATRICES},
+            index=pd.Index(self._players, name="player"),
+        ).drop(player)
+        df = df[(df["together"] > 0) | (df["against"] > 0)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            df["together_win_rate"] = df["together_wins"] / df["together"]
+            df["against_win_rate"] = df["against_wins"] / df["against"]
+        return df.sort_values(["together", "against"], ascending=False, kind="stable")
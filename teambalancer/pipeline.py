@@ -0,0 +1,80 @@
+from .balancer import (
+    LOBBY_TIME_BUDGET,
+    balance_lobbies,
+    balance_teams,
+    position_order,
+)
+from .snapshot import SNAPSHOT_PATH, load_snapshot, refresh_snapshot
+from .storage import BUCKET_NAME, get_blobs
+from .timing import span
+
+
+def rebuild(client, bucket_name=BUCKET_NAME, path=SNAPSHOT_PATH):
+    # バケットの内容が変わっていればスナップショットを作り直して保存する
+    with span("snapshot.list_blobs"):
+        blobs = list(get_blobs(bucket_name, client))
+    return refresh_snapshot(blobs, bucket_name, client, path=path)
+
+
+def open_snapshot(client_factory, bucket_name=BUCKET_NAME, path=SNAPSHOT_PATH):
+    # 保存済みのスナップショットがあればバケットを見ずにそれを使う
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        snapshot = rebuild(client_factory(), bucket_name, path)
+    return snapshot
+
+
+def leaderboard(snapshot, position="ALL", kind="player"):
+    tables = {
+        "player": snapshot.df_all_dict,
+        "champion": snapshot.df_all_champion_dict,
+    }
+    return tables[kind][position]
+
+
+def _orders(snapshot, players):
+    return {
+        player: position_order(
+            player, snapshot.position_priority, snapshot.df_player_dict
+        )
+        for player in players
+    }
+
+
+def team_proposals(snapshot, players, avoid_pairs=False):
+    # 同じ参加者なら結果はスナップショットごとに使い回す
+    players = tuple(sorted(players))
+
+    def solve():
+        orders = _orders(snapshot, players)
+        with span("balancer.balance_teams"):
+            return balance_teams(
+                players,
+                snapshot.ratings,
+                orders,
+                env=snapshot.env,
+                pairs=snapshot.pairs if avoid_pairs else None,
+            )
+
+    return snapshot.memo(("balance", players, avoid_pairs), solve)
+
+
+def lobby_proposals(
+    snapshot, players, time_budget=LOBBY_TIME_BUDGET, avoid_pairs=False
+):
+    # 10 の倍数の参加者を複数ロビーに分けた結果 (ロビーごとの Proposal)
+    players = tuple(sorted(players))
+
+    def solve():
+        orders = _orders(snapshot, players)
+        with span("balancer.balance_lobbies"):
+            return balance_lobbies(
+                players,
+                snapshot.ratings,
+                orders,
+                env=snapshot.env,
+                time_budget=time_budget,
+                pairs=snapshot.pairs if avoid_pairs else None,
+            )
+
+    return snapshot.memo(("lobbies", players, avoid_pairs), solve)
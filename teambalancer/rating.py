@@ -0,0 +1,182 @@
+import itertools
+import math
+from array import array
+
+import numpy as np
+import trueskill
+
+
+def win_probability(team1, team2, env=None):
+    env = env if env else trueskill.global_env()
+    delta_mu = sum(r.mu for r in team1) - sum(r.mu for r in team2)
+    sum_sigma = sum(r.sigma**2 for r in itertools.chain(team1, team2))
+    size = len(team1) + len(team2)
+    denom = math.sqrt(size * (env.beta * env.beta) + sum_sigma)
+    return env.cdf(delta_mu / denom)
+
+
+_ERFC_COEFFS = (
+    0.17087277,
+    -0.82215223,
+    1.48851587,
+    -1.13520398,
+    0.27886807,
+    -0.18628806,
+    0.09678418,
+    0.37409196,
+    1.00002368,
+)
+
+
+def _erfc(x):
+    # trueskill.backends.erfc と同じ近似式の NumPy 版
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    poly = np.zeros_like(t)
+    for coeff in _ERFC_COEFFS:
+        poly = coeff + t * poly
+    r = t * np.exp(-z * z - 1.26551223 + t * poly)
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def batch_cdf(env):
+    if env.cdf is trueskill.backends.cdf:
+        return lambda x: 0.5 * _erfc(-np.asarray(x, dtype=float) / math.sqrt(2))
+    return np.vectorize(env.cdf, otypes=[float])
+
+
+def batch_pdf(env):
+    if env.pdf is trueskill.backends.pdf:
+        return lambda x: np.exp(-(np.asarray(x, dtype=float) ** 2) / 2) / math.sqrt(
+            2 * math.pi
+        )
+    return np.vectorize(env.pdf, otypes=[float])
+
+
+def rate_match(mu, sigma, sign, env=None):
+    # 引き分けの無い 2 チーム戦のレート更新 (env.rate と同じ結果を閉じた式で求める)
+    # mu, sigma: (..., 試合の人数)、sign: 勝ったチームの人は +1、負けたチームの人は -1
+    # 先頭の次元は独立なレート系列 (ALL とポジション別など) としてまとめて計算する
+    env = env if env else trueskill.global_env()
+    mu = np.asarray(mu, dtype=float)
+    sign = np.asarray(sign, dtype=float)
+    var = np.asarray(sigma, dtype=float) ** 2 + env.tau**2
+    c2 = (var + env.beta**2).sum(axis=-1, keepdims=True)
+    c = np.sqrt(c2)
+    draw_margin = trueskill.calc_draw_margin(env.draw_probability, mu.shape[-1], env)
+    x = ((mu * sign).sum(axis=-1, keepdims=True) - draw_margin) / c
+    denom = batch_cdf(env)(x)
+    safe = np.where(denom > 0, denom, 1.0)
+    v = np.where(denom > 0, batch_pdf(env)(x) / safe, -x)
+    w = v * (v + x)
+    return mu + sign * var / c * v, np.sqrt(var * (1 - var / c2 * w))
+
+
+def win_probability_batch(mu1, sigma1, mu2, sigma2, env=None):
+    env = env if env else trueskill.global_env()
+    mu1 = np.asarray(mu1, dtype=float)
+    mu2 = np.asarray(mu2, dtype=float)
+    sigma1 = np.asarray(sigma1, dtype=float)
+    sigma2 = np.asarray(sigma2, dtype=float)
+    delta_mu = mu1.sum(axis=-1) - mu2.sum(axis=-1)
+    sum_sigma = (sigma1**2).sum(axis=-1) + (sigma2**2).sum(axis=-1)
+    size = mu1.shape[-1] + mu2.shape[-1]
+    denom = np.sqrt(size * (env.beta * env.beta) + sum_sigma)
+    return batch_cdf(env)(delta_mu / denom)
+
+
+def minmax_indices(values, max_points):
+    # 区間ごとの最小値と最大値 (と両端) の位置だけを残す間引き
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    buckets = max(1, (max_points - 2) // 2)
+    bucket = np.arange(n) * buckets // n
+    order = np.lexsort((values, bucket))
+    edge = np.flatnonzero(np.diff(bucket[order])) + 1
+    keep = np.concatenate(
+        [[0, n - 1], order[np.r_[0, edge]], order[np.r_[edge - 1, n - 1]]]
+    )
+    return np.unique(keep)
+
+
+class RatingHistory:
+    # (プレイヤー, ポジション) ごとのレート推移を mu / sigma / 試合番号の配列に追記する
+    # 先頭は初期レート (試合番号 -1)
+    def __init__(self):
+        self._chains = {}
+        self._players = {}
+
+    def __contains__(self, player):
+        return player in self._players
+
+    def __iter__(self):
+        return iter(self._players)
+
+    def __len__(self):
+        return len(self._players)
+
+    def add_player(self, player, positions, rating):
+        if player in self._players:
+            return
+        self._players[player] = None
+        for position in positions:
+            self._chains[(player, position)] = (
+                array("d", [rating.mu]),
+                array("d", [rating.sigma]),
+                array("q", [-1]),
+            )
+
+    def append(self, player, position, match, rating):
+        mu, sigma, matches = self._chains[(player, position)]
+        mu.append(rating.mu)
+        sigma.append(rating.sigma)
+        matches.append(match)
+
+    def extend(self, keys, match, mu, sigma):
+        # keys: (プレイヤー, ポジション) の列、mu / sigma はその順の値
+        for key, m, s in zip(keys, mu, sigma):
+            chain_mu, chain_sigma, matches = self._chains[key]
+            chain_mu.append(m)
+            chain_sigma.append(s)
+            matches.append(match)
+
+    def last(self, keys):
+        # (プレイヤー, ポジション) の列に対する現在の mu / sigma の配列
+        chains = [self._chains[key] for key in keys]
+        return (
+            np.array([chain[0][-1] for chain in chains]),
+            np.array([chain[1][-1] for chain in chains]),
+        )
+
+    def rating(self, player, position, back=0):
+        # back=0 で現在のレート、back=1 で 1 試合前のレート
+        mu, sigma, _ = self._chains[(player, position)]
+        i = max(len(mu) - 1 - back, 0)
+        return trueskill.Rating(mu[i], sigma[i])
+
+    def mu(self, player, position):
+        return self._chains[(player, position)][0][-1]
+
+    def count(self, player, position):
+        return len(self._chains[(player, position)][0]) - 1
+
+    def series(self, player, position):
+        # (試合番号, mu, sigma) の配列のコピー
+        # (array を参照する配列が残っていると、その推移に追記できなくなるため)
+        mu, sigma, matches = self._chains[(player, position)]
+        return (
+            np.array(matches, dtype=np.int64),
+            np.array(mu, dtype=np.float64),
+            np.array(sigma, dtype=np.float64),
+        )
+
+    def current(self, players, positions):
+        # 現在の mu / sigma を (プレイヤー, ポジション) の表にする
+        mu = np.array(
+            [[self._chains[(p, k)][0][-1] for k in positions] for p in players]
+        )
+        sigma = np.array(
+            [[self._chains[(p, k)][1][-1] for k in positions] for p in players]
+        )
+        return mu, sigma
@@ -0,0 +1,426 @@
+import pickle
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import trueskill
+
+from .fileio import atomic_write
+from .pairs import PairStats
+from .rating import RatingHistory, rate_match
+
+# 保存形式を変えたら上げる (古いキャッシュは捨てて再計算)
+STATE_VERSION = 6
+
+POSITION_DICT = {
+    "TOP": "TOP",
+    "JUNGLE": "JNG",
+    "MIDDLE": "MID",
+    "BOTTOM": "BOT",
+    "UTILITY": "SUP",
+}
+POSITION_IDX = ["ALL", "TOP", "JNG", "MID", "BOT", "SUP"]
+
+COLUMNS = [
+    "match_count",
+    "win_count",
+    "win_rate",
+    "kill",
+    "death",
+    "assist",
+    "kda",
+    "cs",
+    "gold",
+    "c_ward",
+    "rating",
+    "tier",
+]
+SUM_COLUMNS = [
+    "match_count",
+    "win_count",
+    "kill",
+    "death",
+    "assist",
+    "cs",
+    "gold",
+    "c_ward",
+]
+
+# レートがこの値を超えると一つ上のティア
+TIER_THRESHOLDS = np.array(
+    [
+        5.78,
+        6.68,
+        7.90,
+        9.69,
+        11.76,
+        14.96,
+        16.95,
+        19.01,
+        20.87,
+        23.32,
+        24.86,
+        26.60,
+        28.10,
+        30.75,
+        32.17,
+        33.64,
+        34.88,
+        37.43,
+        38.79,
+        40.11,
+        42.30,
+        43.72,
+        44.77,
+        46.50,
+        48.93,
+        52.72,
+        55.44,
+    ]
+)
+TIER_NAMES = np.array(
+    [
+        "Unrank",
+        "Iron4",
+        "Iron3",
+        "Iron2",
+        "Iron1",
+        "Bronze4",
+        "Bronze3",
+        "Bronze2",
+        "Bronze1",
+        "Silver4",
+        "Silver3",
+        "Silver2",
+        "Silver1",
+        "Gold4",
+        "Gold3",
+        "Gold2",
+        "Gold1",
+        "Platinum4",
+        "Platinum3",
+        "Platinum2",
+        "Platinum1",
+        "Diamond4",
+        "Diamond3",
+        "Diamond2",
+        "Diamond1",
+        "Master",
+        "Grandmaster",
+        "Challenger",
+    ],
+    dtype=object,
+)
+
+
+def new_env():
+    return trueskill.TrueSkill(draw_probability=0.0)
+
+
+@dataclass
+class RecordState:
+    # 集計済みの試合 (blob 名とその内容の指紋) と、その時点までのレートとペアの成績
+    version: int = STATE_VERSION
+    blobs: list = field(default_factory=list)
+    versions: dict = field(default_factory=dict)
+    name_dict: dict = field(default_factory=dict)
+    ratings: RatingHistory = field(default_factory=RatingHistory)
+    pairs: PairStats = field(default_factory=PairStats)
+
+    def can_extend(self, blob_names, name_dict, versions=None):
+        # 既存の試合がそのままの順番で先頭に並んでいれば追加分だけ処理できる
+        # versions があれば、集計済みの試合の中身が変わっていないことも確かめる
+        # (過去の試合が直されたらレートもペアの成績も最初から計算し直す)
+        return (
+            self.version == STATE_VERSION
+            and self.name_dict == name_dict
+            and blob_names[: len(self.blobs)] == self.blobs
+            and (
+                versions is None
+                or all(
+                    self.versions.get(name) == versions.get(name) for name in self.blobs
+                )
+            )
+        )
+
+
+def load_state(path):
+    try:
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return RecordState()
+    if getattr(state, "version", None) != STATE_VERSION:
+        return RecordState()
+    return state
+
+
+def save_state(state, path):
+    atomic_write(path, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def rating_tiers(ratings):
+    ratings = np.asarray(ratings, dtype=float)
+    tiers = TIER_NAMES[np.searchsorted(TIER_THRESHOLDS, ratings, side="left")]
+    return np.where(np.isnan(ratings), None, tiers)
+
+
+def _map_categories(column, mapping):
+    # カテゴリ名だけを変換してから各行に展開する
+    categories = column.cat.categories
+    values = np.array([mapping.get(c, c) for c in categories] + [None], dtype=object)
+    return values[column.cat.codes.to_numpy()]
+
+
+def match_order(raw, order):
+    # order (blob 名の並び) に含まれる試合の行を、その順番に並べた位置と試合番号
+    rank = {match_id: i for i, match_id in enumerate(order)}
+    categories = raw["match_id"].cat.categories
+    ranks = np.array([rank.get(c, -1) for c in categories] + [-1], dtype="int64")
+    match = ranks[raw["match_id"].cat.codes.to_numpy()]
+    rows = np.flatnonzero(match >= 0)
+    rows = rows[np.argsort(match[rows], kind="stable")]
+    return rows, match[rows]
+
+
+def match_table(raw, name_dict, order):
+    # 全試合を 1 行 1 プレイヤーの縦長テーブルにまとめる
+    rows, match = match_order(raw, order)
+    raw = raw.iloc[rows]
+    return pd.DataFrame(
+        {
+            "match": match.astype("int32"),
+            "player": pd.Categorical(_map_categories(raw["player"], name_dict)),
+            "champion": raw["skin"].array,
+            "position": pd.Categorical(
+                _map_categories(raw["individualPosition"], POSITION_DICT),
+                categories=POSITION_IDX[1:],
+            ),
+            "team": raw["team"].to_numpy(dtype="int16"),
+            "win": (raw["win"] == "Win").to_numpy(dtype=bool),
+            "kill": raw["championsKilled"].to_numpy(dtype="int32"),
+            "death": raw["numDeaths"].to_numpy(dtype="int32"),
+            "assist": raw["assists"].to_numpy(dtype="int32"),
+            "cs": raw["cs"].to_numpy(dtype="int32"),
+            "gold": raw["goldEarned"].to_numpy(dtype="int32"),
+            "c_ward": raw["visionWardsBoughtInGame"].to_numpy(dtype="int32"),
+        }
+    )
+
+
+class MatchHistory:
+    # 試合履歴の表示用の表 (全試合分を表示順に並べた 1 つの表と各試合の開始行)
+    def __init__(self, table, players, champions, starts, splits):
+        self.table = table
+        self._players = players
+        self._champions = champions
+        self._starts = starts
+        self._splits = splits
+
+    def __len__(self):
+        return len(self._splits)
+
+    def teams(self, number):
+        # number 試合目 (1 始まり) の先頭 5 人と残りの表
+        start, split, end = (
+            self._starts[number - 1],
+            self._splits[number - 1],
+            self._starts[number],
+        )
+        return self.table.iloc[start:split], self.table.iloc[split:end]
+
+    def find(self, player=None, champion=None):
+        # 条件に合う試合番号を新しい順に返す
+        if player is None and champion is None:
+            return np.arange(len(self), 0, -1)
+        mask = np.ones(len(self.table), dtype=bool)
+        if player is not None:
+            mask &= self._players == player
+        if champion is not None:
+            mask &= self._champions == champion
+        match = np.searchsorted(self._starts, np.flatnonzero(mask), side="right")
+        return np.unique(match)[::-1]
+
+
+def match_history(raw, order):
+    # 試合ごとに先頭 5 人と残りに分け、それぞれポジション順に並べておく
+    rows, match = match_order(raw, order)
+    raw = raw.iloc[rows]
+    _, match = np.unique(match, return_inverse=True)
+    starts = np.flatnonzero(np.r_[True, np.diff(match) != 0])
+    second = np.arange(len(match)) - starts[match] >= 5
+    position = pd.Index(list(POSITION_DICT)).get_indexer(
+        raw["individualPosition"].astype(str)
+    )
+    sort = np.lexsort((position, second, match))
+    raw = raw.iloc[sort]
+    players = raw["player"].to_numpy(dtype=object)
+    table = pd.DataFrame(
+        {
+            "champion": raw["skin"].to_numpy(dtype=object),
+            "kill": raw["championsKilled"].to_numpy(),
+            "death": raw["numDeaths"].to_numpy(),
+            "assist": raw["assists"].to_numpy(),
+            "kda": raw["kda"].to_numpy(),
+            "cs": raw["cs"].to_numpy(),
+            "gold": raw["goldEarned"].to_numpy(),
+            "c_ward": raw["visionWardsBoughtInGame"].to_numpy(),
+            "win": raw["win"].to_numpy(dtype=object),
+            "side": raw["team"].to_numpy(),
+        },
+        index=pd.Index(players, name="player"),
+    )
+    counts = np.diff(np.r_[starts, len(match)])
+    return MatchHistory(
+        table,
+        players,
+        table["champion"].to_numpy(),
+        np.r_[starts, len(match)],
+        starts + np.minimum(counts, 5),
+    )
+
+
+def replay(state, matches, blob_names, env):
+    # matches: match_table(..., blob_names) の結果、state に無い試合だけレート計算する
+    new = matches[matches["match"] >= len(state.blobs)]
+    match = new["match"].to_numpy()
+    players = new["player"].to_numpy(dtype=object)
+    positions = new["position"].to_numpy(dtype=object)
+    teams = new["team"].to_numpy()
+    wins = new["win"].to_numpy()
+    bounds = np.flatnonzero(np.diff(match)) + 1
+    for rows in np.split(np.arange(len(new)), bounds):
+        if len(rows) == 0:
+            continue
+        names = players[rows]
+        for player_name in names:
+            if player_name not in state.ratings:
+                state.ratings.add_player(player_name, POSITION_IDX, env.create_rating())
+
+        last = rows[-1]
+        win_team = (wins[last] and teams[last] == 100) or (
+            not wins[last] and teams[last] != 100
+        )
+        # 勝ったチームを +1、負けたチームを -1 とし、ALL とポジション別を同時に更新する
+        sign = np.where((teams[rows] == 100) == win_team, 1.0, -1.0)
+        keys = [(p, "ALL") for p in names] + list(zip(names, positions[rows]))
+        mu, sigma = state.ratings.last(keys)
+        mu, sigma = rate_match(mu.reshape(2, -1), sigma.reshape(2, -1), sign, env=env)
+        state.ratings.extend(keys, match[last], mu.ravel(), sigma.ravel())
+        state.pairs.add_match(names[sign > 0], names[sign < 0])
+
+    state.blobs = list(blob_names)
+    return state
+
+
+def aggregate(matches, keys):
+    # (キー, ポジション) ごとの合計を 1 回の groupby で求め、ALL はその合計
+    table = matches.assign(match_count=1, win_count=matches["win"].astype("int64"))
+    sums = table.groupby(keys + ["position"], observed=True, sort=False)[
+        SUM_COLUMNS
+    ].sum()
+    totals = sums.groupby(level=keys, sort=False).sum()
+    totals = totals.set_index(
+        pd.Index(["ALL"] * len(totals), name="position"), append=True
+    )
+    sums.index = sums.index.set_levels(
+        sums.index.levels[-1].astype(str), level="position"
+    )
+    stats = pd.concat([totals, sums])
+
+    # データ正規化
+    stats["win_rate"] = stats["win_count"] / stats["match_count"]
+    for column in ("kill", "death", "assist", "cs", "gold", "c_ward"):
+        stats[column] = stats[column] / stats["match_count"]
+    stats["kda"] = (stats["kill"] + stats["assist"]) / stats["death"].where(
+        stats["death"] != 0, 1
+    )
+    stats["rating"] = np.nan
+    stats["tier"] = None
+    return stats[COLUMNS].sort_index()
+
+
+class StatsView(Mapping):
+    # キーごとの 6 行 (ALL + 各ポジション) の表を集計表から切り出して返す
+    def __init__(self, stats, keys):
+        self._stats = stats
+        self._keys = list(keys)
+
+    def __getitem__(self, key):
+        try:
+            df = self._stats.loc[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return self._fill_missing(df.reindex(POSITION_IDX))
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._stats.index
+
+    @staticmethod
+    def _fill_missing(df):
+        # 試合の無い行は回数 0、ティアは None (reindex で入る NaN を戻す)
+        df[["match_count", "win_count"]] = (
+            df[["match_count", "win_count"]].fillna(0).astype("int64")
+        )
+        df["tier"] = df["tier"].astype(object).where(df["tier"].notna(), None)
+        return df
+
+    def by_position(self):
+        # 全キー x 全ポジションに揃えた表をポジションごとに切り出す
+        index = pd.MultiIndex.from_product([self._keys, POSITION_IDX])
+        full = self._fill_missing(self._stats.reindex(index))
+        return {
+            position: full.xs(position, level=1).rename_axis(None)
+            for position in POSITION_IDX
+        }
+
+    def totals_by_first_key(self):
+        # 複合キー (player, champion) の ALL 行を player ごとにまとめる
+        totals = self._stats.xs("ALL", level="position")
+        totals = totals.reindex(pd.MultiIndex.from_tuples(self._keys))
+        return {key: df.droplevel(0) for key, df in totals.groupby(level=0, sort=False)}
+
+
+def build_stats(state, matches):
+    player_stats = aggregate(matches, ["player"])
+    player_stats["rating"] = [
+        state.ratings.mu(player, position) for player, position in player_stats.index
+    ]
+    player_stats["tier"] = rating_tiers(player_stats["rating"])
+    set_keys = pd.unique(
+        pd.Series(list(zip(matches["player"], matches["champion"])), dtype=object)
+    )
+    return (
+        StatsView(player_stats, pd.unique(matches["player"])),
+        StatsView(aggregate(matches, ["champion"]), pd.unique(matches["champion"])),
+        StatsView(aggregate(matches, ["player", "champion"]), set_keys),
+    )
+
+
+def build_all_tables(df_player_dict, df_champion_dict, df_set_dict):
+    # 全体集計用データ作成 (集計表を並べ替えるだけで作る)
+    df_all_dict = df_player_dict.by_position()
+    df_all_champion_dict = df_champion_dict.by_position()
+    df_all_set_dict = df_set_dict.totals_by_first_key()
+
+    # 表示順に並べておく
+    df_all_dict = {
+        key: df.sort_values("rating", ascending=False, kind="stable")
+        for key, df in df_all_dict.items()
+    }
+    df_all_champion_dict = {
+        key: df.sort_values("match_count", ascending=False, kind="stable")
+        for key, df in df_all_champion_dict.items()
+    }
+    df_all_set_dict = {
+        key: df.sort_values("match_count", ascending=False, kind="stable")
+        for key, df in df_all_set_dict.items()
+    }
+    return df_all_dict, df_all_champion_dict, df_all_set_dict
@@ -0,0 +1,271 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+import trueskill
+
+from .fileio import atomic_write
+from .manifest import Manifest, blob_entry, fingerprint
+from .matchstore import open_store
+from .record import (
+    RecordState,
+    build_all_tables,
+    build_stats,
+    load_state,
+    match_history,
+    match_table,
+    new_env,
+    replay,
+    save_state,
+)
+from .storage import BUCKET_NAME, CONFIG_FILES, get_blobs, get_dataframe
+from .timing import count, span, timings
+
+STATE_PATH = "cache/record.pickle"
+SNAPSHOT_PATH = "cache/snapshot.pickle"
+SNAPSHOT_VERSION = 2
+STORE_PATH = "cache/matches"
+CSV_DIR = "csv"
+# 前回取り込んだ blob の一覧 (世代, md5, サイズ) と設定ファイルの写し
+MANIFEST_PATH = "cache/manifest.json"
+CONFIG_DIR = "cache/config"
+
+# 自動でバケットの更新を確認する間隔と、更新ボタン連打時に確認を省く間隔 (秒)
+CHECK_INTERVAL = 300
+REFRESH_INTERVAL = 5
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    # 全セッションで共有する読み取り専用のデータ一式
+    version: str
+    env: object
+    ratings: object
+    pairs: object
+    position_priority: dict
+    history: object
+    df_player_dict: object
+    df_champion_dict: object
+    df_set_dict: object
+    df_all_dict: dict
+    df_all_champion_dict: dict
+    df_all_set_dict: dict
+    _memo: dict = field(default_factory=dict, repr=False, compare=False)
+    _memo_lock: object = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def memo(self, key, func):
+        # このスナップショットから派生する値を 1 度だけ計算して共有する
+        # 計算はロックの外で行い、同じ key を求めた呼び出しだけがその完了を待つ
+        with self._memo_lock:
+            future = self._memo.get(key)
+            owner = future is None
+            if owner:
+                future = self._memo[key] = Future()
+        if not owner:
+            count("snapshot.memo_hit")
+            return future.result()
+        count("snapshot.memo_miss")
+        try:
+            result = func()
+        except BaseException as e:
+            # 失敗は待っている呼び出しにだけ伝え、次の呼び出しで計算し直す
+            with self._memo_lock:
+                del self._memo[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def __getstate__(self):
+        # メモとロックは保存せず、TrueSkill の環境はパラメータだけ保存する
+        state = dict(self.__dict__)
+        del state["_memo"], state["_memo_lock"]
+        env = state["env"]
+        state["env"] = {
+            "mu": env.mu,
+            "sigma": env.sigma,
+            "beta": env.beta,
+            "tau": env.tau,
+            "draw_probability": env.draw_probability,
+        }
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state, env=trueskill.TrueSkill(**state["env"]))
+        self.__dict__.update(state, _memo={}, _memo_lock=threading.Lock())
+
+
+def blob_version(blobs):
+    digest = hashlib.sha1()
+    for blob in sorted(blobs, key=lambda b: b.name):
+        digest.update(f"{blob.name}:{getattr(blob, 'generation', '')}\n".encode())
+    return digest.hexdigest()
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    try:
+        with open(path, "rb") as f:
+            version, snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if version != SNAPSHOT_VERSION:
+        return None
+    snapshot.env.make_as_global()
+    return snapshot
+
+
+def save_snapshot(snapshot, path=SNAPSHOT_PATH):
+    data = pickle.dumps((SNAPSHOT_VERSION, snapshot), protocol=pickle.HIGHEST_PROTOCOL)
+    atomic_write(path, data)
+
+
+def build_snapshot(blobs, bucket_name, client, version=None):
+    env = new_env()
+    env.make_as_global()
+    with span("snapshot.open_store"):
+        store = open_store(STORE_PATH, csv_dir=CSV_DIR)
+    # 前回の一覧と比べて、追加・変更された blob だけを取り込む
+    manifest = Manifest.load(MANIFEST_PATH)
+    diff = manifest.diff(blobs)
+    count("snapshot.added_blobs", len(diff.added))
+    count("snapshot.changed_blobs", len(diff.changed))
+    with span("snapshot.get_dataframe"):
+        raw, name_dict, position_priority = get_dataframe(
+            blobs, bucket_name, client, store, diff=diff, config_dir=CONFIG_DIR
+        )
+    manifest.update(blobs)
+    manifest.save(MANIFEST_PATH)
+    match_blobs = [blob.name for blob in blobs if blob.name not in CONFIG_FILES]
+    versions = {
+        blob.name: fingerprint(blob_entry(blob))
+        for blob in blobs
+        if blob.name not in CONFIG_FILES
+    }
+    with span("snapshot.match_table"):
+        matches = match_table(raw, name_dict, match_blobs)
+
+    # 前回までのレートを読み込み、追加された試合だけレート計算する
+    # 集計済みの試合の中身が変わっていたら最初から計算し直す
+    state = load_state(STATE_PATH)
+    if not state.can_extend(match_blobs, name_dict, versions):
+        state = RecordState(name_dict=name_dict)
+    if state.blobs != match_blobs or not os.path.isfile(STATE_PATH):
+        count("snapshot.replayed_matches", len(match_blobs) - len(state.blobs))
+        with span("snapshot.replay"):
+            replay(state, matches, match_blobs, env)
+        state.versions = versions
+        with span("snapshot.save_state"):
+            save_state(state, STATE_PATH)
+
+    with span("snapshot.stats"):
+        df_player_dict, df_champion_dict, df_set_dict = build_stats(state, matches)
+    with span("snapshot.leaderboards"):
+        df_all_dict, df_all_champion_dict, df_all_set_dict = build_all_tables(
+            df_player_dict, df_champion_dict, df_set_dict
+        )
+    with span("snapshot.history"):
+        history = match_history(raw, match_blobs)
+    return Snapshot(
+        version=version or blob_version(blobs),
+        env=env,
+        ratings=state.ratings,
+        pairs=state.pairs,
+        position_priority=position_priority,
+        history=history,
+        df_player_dict=df_player_dict,
+        df_champion_dict=df_champion_dict,
+        df_set_dict=df_set_dict,
+        df_all_dict=df_all_dict,
+        df_all_champion_dict=df_all_champion_dict,
+        df_all_set_dict=df_all_set_dict,
+    )
+
+
+def refresh_snapshot(blobs, bucket_name, client, version=None, path=SNAPSHOT_PATH):
+    # cron 等で作り済みのスナップショットが同じ版ならそれを使い、違えば作り直して保存する
+    version = version or blob_version(blobs)
+    with span("snapshot.load"):
+        snapshot = load_snapshot(path)
+    if snapshot is not None and snapshot.version == version:
+        count("snapshot.loaded")
+        return snapshot
+    count("snapshot.rebuild")
+    with span("snapshot.build"):
+        snapshot = build_snapshot(blobs, bucket_name, client, version)
+    with span("snapshot.save"):
+        save_snapshot(snapshot, path)
+    timings.log_summary()
+    return snapshot
+
+
+class SnapshotCache:
+    # プロセスに 1 つだけ持ち、バケットの blob 世代が変わったときだけ作り直す
+    # 一覧の確認と作り直しは 1 つのスレッドだけが行い、その間も他のセッションには
+    # 手元のスナップショットを返す (まだ無いときだけ出来上がるのを待つ)
+    def __init__(
+        self,
+        bucket_name=BUCKET_NAME,
+        check_interval=CHECK_INTERVAL,
+        snapshot_path=SNAPSHOT_PATH,
+    ):
+        self.bucket_name = bucket_name
+        self.check_interval = check_interval
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = None
+
+    def _fresh(self, refresh):
+        # (手元のスナップショット, 確認し直さなくてよいか)
+        with self._lock:
+            if self._snapshot is None:
+                return None, False
+            elapsed = time.monotonic() - self._checked_at
+            interval = REFRESH_INTERVAL if refresh else self.check_interval
+            return self._snapshot, elapsed < interval
+
+    def get(self, client_factory, refresh=False):
+        snapshot, fresh = self._fresh(refresh)
+        if fresh:
+            count("snapshot.cache_hit")
+            return snapshot
+        if not self._refresh_lock.acquire(blocking=snapshot is None):
+            # 他のスレッドが確認中なので、終わるまでは今のスナップショットを使う
+            count("snapshot.stale_hit")
+            return snapshot
+        try:
+            # 待っている間に他のスレッドが確認を終えていればそれを使う
+            snapshot, fresh = self._fresh(refresh)
+            if fresh:
+                count("snapshot.cache_hit")
+                return snapshot
+            client = client_factory()
+            with span("snapshot.list_blobs"):
+                blobs = list(get_blobs(self.bucket_name, client))
+            version = blob_version(blobs)
+            if snapshot is None or snapshot.version != version:
+                snapshot = refresh_snapshot(
+                    blobs, self.bucket_name, client, version, self.snapshot_path
+                )
+            else:
+                count("snapshot.unchanged")
+            with self._lock:
+                self._snapshot = snapshot
+                self._checked_at = time.monotonic()
+            return snapshot
+        finally:
+            self._refresh_lock.release()
+
+
+_cache = SnapshotCache()
+
+
+def get_snapshot(client_factory, refresh=False):
+    return _cache.get(client_factory, refresh=refresh)
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+
+import pandas as pd
+
+from .fileio import atomic_write
+from .timing import count, span
+
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = "custom-match-history"
+CONFIG_FILES = ("players_name.json", "position_priority.json")
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRIES = 3
+
+
+@dataclass(frozen=True)
+class Download:
+    name: str
+    content: bytes
+    seconds: float
+    attempts: int
+
+
+def make_client(
+    credentials_path=None, credentials_info=None, pool_size=DOWNLOAD_WORKERS
+):
+    # st.secrets を使わずに GCS クライアントを作る
+    # 鍵 (ファイルか dict) の指定が無ければ GOOGLE_APPLICATION_CREDENTIALS などの既定の認証を使う
+    # 並列ダウンロードの数だけ接続を使い回せるよう、プールを広げた HTTP セッションを作って渡す
+    # (クライアントは作り直さずに使い回す前提)
+    import google.auth
+    from google.auth.credentials import with_scopes_if_required
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from google.oauth2 import service_account
+    from requests.adapters import HTTPAdapter
+
+    if credentials_path:
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_path
+        )
+        project = credentials.project_id
+    elif credentials_info:
+        credentials = service_account.Credentials.from_service_account_info(
+            credentials_info
+        )
+        project = credentials.project_id
+    else:
+        credentials, project = google.auth.default()
+    credentials = with_scopes_if_required(credentials, storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_blobs(bucket_name, client):
+    blobs = client.list_blobs(bucket_name)
+    return blobs
+
+
+def read_file(bucket_name, file_path, client):
+    bucket = client.bucket(bucket_name)
+    content = bucket.blob(file_path).download_as_bytes()
+    return content
+
+
+def download_blobs(
+    names,
+    bucket_name,
+    client,
+    max_workers=DOWNLOAD_WORKERS,
+    retries=DOWNLOAD_RETRIES,
+    backoff=0.5,
+):
+    names = list(names)
+    if not names:
+        return {}
+    bucket = client.bucket(bucket_name)
+    workers = max(1, min(max_workers, len(names)))
+
+    def fetch(name):
+        start = time.perf_counter()
+        for attempt in range(1, retries + 1):
+            try:
+                content = bucket.blob(name).download_as_bytes()
+            except Exception:
+                if attempt == retries:
+                    raise
+                count("storage.download_retries")
+                logger.warning("retry %s (%d/%d)", name, attempt, retries)
+                time.sleep(backoff * 2 ** (attempt - 1))
+            else:
+                return Download(name, content, time.perf_counter() - start, attempt)
+
+    start = time.perf_counter()
+    with span("storage.download"), ThreadPoolExecutor(max_workers=workers) as executor:
+        downloads = {d.name: d for d in executor.map(fetch, names)}
+    count("storage.downloaded_blobs", len(downloads))
+    count("storage.downloaded_bytes", sum(len(d.content) for d in downloads.values()))
+    for d in downloads.values():
+        logger.debug("%s: %.3fs (%d attempts)", d.name, d.seconds, d.attempts)
+    logger.info(
+        "downloaded %d blobs in %.3fs (%d workers)",
+        len(downloads),
+        time.perf_counter() - start,
+        workers,
+    )
+    return downloads
+
+
+def _read_config(name, config_dir):
+    if config_dir is None:
+        return None
+    try:
+        with open(os.path.join(config_dir, name), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def get_dataframe(
+    _blobs,
+    bucket_name,
+    _client,
+    store,
+    max_workers=DOWNLOAD_WORKERS,
+    diff=None,
+    config_dir=None,
+):
+    # diff (ManifestDiff) があれば、追加・変更された blob と手元に無い設定ファイルだけを取りに行き、
+    # 変わった試合は store の行を入れ替える
+    # 無ければ設定ファイルは毎回、試合は store に無いものだけをダウンロードする
+    file_paths = [blob.name for blob in _blobs]
+    stored = set(store.matches)
+    fresh = set(diff.added + diff.changed) if diff is not None else set()
+    # 前回の一覧に無いのに store にある試合 (一覧を持つ前に csv/ から取り込んだものや、
+    # 一覧を保存する前に止まったときのもの) は中身を確かめられないので一度取り直す
+    replace = (
+        set(diff.changed) | (set(diff.added) & stored) if diff is not None else set()
+    )
+    configs = {}
+    # 設定ファイルとまだ取り込んでいない (中身の変わった) 試合をまとめて並列にダウンロード
+    missing = []
+    for file_path in file_paths:
+        if file_path in CONFIG_FILES:
+            # 変わっていない設定ファイルは手元の写しを使う
+            if diff is not None and file_path not in fresh:
+                configs[file_path] = _read_config(file_path, config_dir)
+            if configs.get(file_path) is None:
+                missing.append(file_path)
+        elif file_path not in stored or file_path in replace:
+            missing.append(file_path)
+    downloads = download_blobs(missing, bucket_name, _client, max_workers=max_workers)
+
+    df_dict = {}
+    with span("storage.read_csv"):
+        for file_path in missing:
+            if file_path in CONFIG_FILES:
+                configs[file_path] = downloads[file_path].content
+                if config_dir:
+                    atomic_write(
+                        os.path.join(config_dir, file_path), configs[file_path]
+                    )
+            else:
+                df_dict[file_path] = pd.read_csv(BytesIO(downloads[file_path].content))
+    name_dict = json.loads(configs.get("players_name.json") or "{}")
+    position_priority = json.loads(configs.get("position_priority.json") or "{}")
+    with span("storage.store_append"):
+        count("storage.matches_ingested", store.append(df_dict, replace=replace))
+    with span("storage.store_read"):
+        raw = store.read()
+    return raw, name_dict, position_priority
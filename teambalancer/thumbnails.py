@@ -0,0 +1,155 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from .fileio import atomic_write, locked
+from .timing import count, span
+
+IMAGE_DIR = "images"
+THUMBNAIL_DIR = "thumbnails"
+# 作っておく縮小画像の幅 (px) と、一覧に出す幅
+WIDTHS = (320, 640)
+DISPLAY_WIDTH = 640
+JPEG_QUALITY = 80
+EXTENSIONS = (".jpeg", ".jpg", ".png")
+
+
+def content_key(data):
+    return hashlib.sha224(data).hexdigest()
+
+
+def render_thumbnails(data, directory, key, widths=WIDTHS):
+    # 向きを直して RGB にし、各幅に縮小した JPEG を <key>_<幅>.jpeg として書く
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data))).convert("RGB")
+    os.makedirs(directory, exist_ok=True)
+    for width in widths:
+        path = os.path.join(directory, f"{key}_{width}.jpeg")
+        if os.path.isfile(path):
+            continue
+        variant = image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            variant = image.resize((width, height), Image.LANCZOS)
+        buffer = BytesIO()
+        variant.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        atomic_write(path, buffer.getvalue())
+
+
+def _backfill_one(args):
+    image_path, directory = args
+    with open(image_path, "rb") as f:
+        data = f.read()
+    key = content_key(data)
+    render_thumbnails(data, directory, key)
+    return os.path.basename(image_path), key
+
+
+class ImageStore:
+    # images/ の元画像と images/thumbnails/ の縮小画像
+    # 縮小画像は元画像の内容のハッシュで名前を付け、manifest.json に画像名との対応を持つ
+    def __init__(self, image_dir=IMAGE_DIR):
+        self.image_dir = image_dir
+        self.thumbnail_dir = os.path.join(image_dir, THUMBNAIL_DIR)
+
+    def _file(self, name):
+        return os.path.join(self.thumbnail_dir, name)
+
+    def manifest(self):
+        try:
+            with open(self._file("manifest.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _update_manifest(self, entries):
+        with locked(self._file("lock")):
+            manifest = self.manifest()
+            manifest.update(entries)
+            atomic_write(
+                self._file("manifest.json"), json.dumps(manifest, ensure_ascii=False)
+            )
+        return manifest
+
+    def add(self, data, filename):
+        # アップロードされた画像を保存して画像名を返す (同じ内容なら既存の画像名)
+        from PIL import Image, ImageOps
+
+        key = content_key(data)
+        for name, known in self.manifest().items():
+            if known == key:
+                count("images.duplicate")
+                return name
+        ext = os.path.splitext(filename)[1].lower() or ".jpeg"
+        name = f"{key}{ext}"
+        with span("images.upload"):
+            buffer = BytesIO()
+            image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+            image.save(buffer, format=Image.registered_extensions()[ext])
+            atomic_write(os.path.join(self.image_dir, name), buffer.getvalue())
+            render_thumbnails(data, self.thumbnail_dir, key)
+        self._update_manifest({name: key})
+        return name
+
+    def original(self, name):
+        return os.path.join(self.image_dir, name)
+
+    def _has_thumbnails(self, name, manifest, widths=WIDTHS):
+        key = manifest.get(name)
+        return key is not None and all(
+            os.path.isfile(self._file(f"{key}_{width}.jpeg")) for width in widths
+        )
+
+    def thumbnail(self, name, width=DISPLAY_WIDTH, manifest=None):
+        # 縮小画像のパス (まだ無ければここで作る)
+        manifest = self.manifest() if manifest is None else manifest
+        if not self._has_thumbnails(name, manifest, [width]):
+            # 同時に開いた別のセッションと同じ縮小画像を作らないよう、作る間はロックし、
+            # ロックを取ってから改めて確かめる
+            with locked(self._file("render.lock")):
+                manifest = self.manifest()
+                if not self._has_thumbnails(name, manifest, [width]):
+                    count("images.thumbnail_miss")
+                    with span("images.thumbnail"):
+                        _, key = _backfill_one(
+                            (self.original(name), self.thumbnail_dir)
+                        )
+                    manifest = self._update_manifest({name: key})
+        return self._file(f"{manifest[name]}_{width}.jpeg")
+
+    def backfill(self, processes=None):
+        # 既存の元画像のうち縮小画像の無いものを並列に作る
+        manifest = self.manifest()
+        todo = [
+            path
+            for path in sorted(glob.glob(os.path.join(self.image_dir, "*")))
+            if path.lower().endswith(EXTENSIONS)
+            and not self._has_thumbnails(os.path.basename(path), manifest)
+        ]
+        if not todo:
+            return 0
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            entries = dict(
+                pool.map(_backfill_one, [(path, self.thumbnail_dir) for path in todo])
+            )
+        self._update_manifest(entries)
+        return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="既存の画像の縮小版をまとめて作る")
+    parser.add_argument("--images", default=IMAGE_DIR)
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+    done = ImageStore(args.images).backfill(args.processes)
+    print(f"created thumbnails for {done} images")
+
+
+if __name__ == "__main__":
+    # python -m teambalancer.thumbnails
+    main()
@@ -0,0 +1,72 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 区間ごとに保持する直近の計測数
+HISTORY = 50
+
+
+class Timings:
+    # 処理区間ごとの所要時間とカウンタ (プロセス全体で共有する)
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._spans = defaultdict(lambda: deque(maxlen=self.history))
+        self._counters = defaultdict(int)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._spans[name].append((time.time(), seconds))
+        logger.debug(json.dumps({"span": name, "seconds": round(seconds, 6)}))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def summary(self):
+        with self._lock:
+            spans = {name: list(values) for name, values in self._spans.items()}
+            counters = dict(self._counters)
+        return {
+            "spans": {
+                name: {
+                    "last": values[-1][1],
+                    "mean": sum(s for _, s in values) / len(values),
+                    "max": max(s for _, s in values),
+                    "count": len(values),
+                    "at": values[-1][0],
+                }
+                for name, values in sorted(spans.items())
+                if values
+            },
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.summary(), ensure_ascii=False, **kwargs)
+
+    def log_summary(self, level=logging.INFO):
+        logger.log(level, self.to_json())
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+
+timings = Timings()
+span = timings.span
+count = timings.count
@@ -0,0 +1,36 @@
+import pytest
+from check_import_time import (
+    BUDGETS,
+    check,
+    eager_imports,
+    measure,
+    overhead,
+    targets,
+)
+
+# 以前のように重いライブラリを起動時に読み込んだ場合
+EAGER_IMPORTS = """
+import matplotlib.pyplot
+from google.cloud import storage
+from google.oauth2 import service_account
+from PIL import Image, ImageOps
+"""
+
+
+@pytest.mark.parametrize("name", ["app", "cli"])
+def test_import_time(name):
+    reference, budget = BUDGETS[name]
+    assert check(name, targets()[name], reference, budget, repeat=3)
+
+
+def test_budget_rejects_eager_imports():
+    # 予算が緩すぎて、重いライブラリを起動時に読み込んでも通ってしまわないこと
+    reference, budget = BUDGETS["app"]
+    extra, _ = overhead(targets()["app"] + EAGER_IMPORTS, reference, repeat=3)
+    assert extra > budget
+
+
+@pytest.mark.parametrize("name", ["app", "cli"])
+def test_heavy_modules_are_deferred(name):
+    _, modules = measure(targets()[name])
+    assert eager_imports(modules) == []
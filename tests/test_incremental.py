@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from synthetic import generate_bucket
+
+from teambalancer.fakestorage import FakeStorageClient
+from teambalancer.record import POSITION_IDX
+from teambalancer.snapshot import build_snapshot
+from teambalancer.storage import BUCKET_NAME, get_blobs
+from teambalancer.timing import timings
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    # 80 試合を作り、最初は 60 試合だけをバケットに置く
+    source = generate_bucket(str(tmp_path / "source"), 80, seed=0)
+    path = tmp_path / "bucket" / BUCKET_NAME
+    path.mkdir(parents=True)
+    names = sorted(os.listdir(source))
+    for name in names[:60] + ["players_name.json", "position_priority.json"]:
+        shutil.copy(os.path.join(source, name), path)
+    return source, path
+
+
+def build(root, workdir, monkeypatch):
+    # workdir の cache/ を使って、バケットの今の中身からスナップショットを作る
+    os.makedirs(workdir, exist_ok=True)
+    monkeypatch.chdir(workdir)
+    client = FakeStorageClient(str(root))
+    blobs = list(get_blobs(BUCKET_NAME, client))
+    return build_snapshot(blobs, BUCKET_NAME, client)
+
+
+def replayed(func):
+    before = timings.summary()["counters"].get("snapshot.replayed_matches", 0)
+    result = func()
+    return result, timings.summary()["counters"]["snapshot.replayed_matches"] - before
+
+
+def assert_same(actual, expected):
+    assert sorted(actual.ratings) == sorted(expected.ratings)
+    for player in expected.ratings:
+        for position in POSITION_IDX:
+            for a, b in zip(
+                actual.ratings.series(player, position),
+                expected.ratings.series(player, position),
+            ):
+                np.testing.assert_array_equal(a, b)
+    for player in expected.ratings:
+        pd.testing.assert_frame_equal(
+            actual.pairs.partners(player), expected.pairs.partners(player)
+        )
+    for key, df in expected.df_all_dict.items():
+        pd.testing.assert_frame_equal(actual.df_all_dict[key], df)
+
+
+def test_incremental_refresh_matches_full_replay(bucket, tmp_path, monkeypatch):
+    source, path = bucket
+    root = tmp_path / "bucket"
+    build(root, tmp_path / "app", monkeypatch)
+
+    # 試合が追加されたら、追加分だけをレート計算して全件計算と同じ結果になる
+    for name in sorted(os.listdir(source))[60:80]:
+        shutil.copy(os.path.join(source, name), path)
+    incremental, count = replayed(lambda: build(root, tmp_path / "app", monkeypatch))
+    assert count == 20
+    assert_same(incremental, build(root, tmp_path / "fresh1", monkeypatch))
+
+    # レート計算済みの試合の中身が変わったら、最初から計算し直す
+    target = path / sorted(os.listdir(source))[10]
+    df = pd.read_csv(target)
+    df["win"] = df["win"].map({"Win": "Fail", "Fail": "Win"})
+    df.to_csv(target, index=False)
+    stat = os.stat(target)
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed, count = replayed(lambda: build(root, tmp_path / "app", monkeypatch))
+    assert count == 80
+    fresh = build(root, tmp_path / "fresh2", monkeypatch)
+    assert_same(changed, fresh)
+    with pytest.raises(AssertionError):
+        assert_same(changed, incremental)
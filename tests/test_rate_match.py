@@ -0,0 +1,52 @@
+import os
+
+import pytest
+from check_rate_kernel import TOLERANCE, load_matches, max_difference, reference_replay
+from synthetic import generate_bucket
+
+from teambalancer.matchstore import MatchStore, import_csv_dir
+from teambalancer.rating import RatingHistory
+from teambalancer.record import RecordState, match_table, new_env, replay
+
+CSV_DIR = os.path.join(os.path.dirname(__file__), "..", "csv")
+
+
+def csv_matches(workdir):
+    # 同梱の csv/ の全試合を、アプリと同じ blob 名の順に並べる
+    store = MatchStore(os.path.join(workdir, "matches"))
+    import_csv_dir(CSV_DIR, store)
+    match_blobs = sorted(store.matches)
+    return match_table(store.read(), {}, match_blobs), match_blobs, {}
+
+
+def synthetic_matches(workdir):
+    root = os.path.join(workdir, "bucket")
+    generate_bucket(root, 300, seed=0)
+    return load_matches(root, workdir)
+
+
+@pytest.mark.parametrize("load", [csv_matches, synthetic_matches])
+def test_rate_match_agrees_with_env_rate(load, tmp_path):
+    # 全試合を env.rate と閉じた式の両方でレート計算し、推移が一致することを確かめる
+    matches, match_blobs, name_dict = load(str(tmp_path))
+    env = new_env()
+    env.make_as_global()
+    expected = reference_replay(
+        RecordState(name_dict=name_dict), matches, match_blobs, env
+    )
+    actual = RecordState(name_dict=name_dict)
+    replay(actual, matches, match_blobs, env)
+    assert len(expected.ratings) > 0
+    assert max_difference(expected, actual) <= TOLERANCE
+
+
+def test_series_does_not_block_append():
+    # series の配列を持ったままでも、同じ推移にレートを追記できる
+    env = new_env()
+    history = RatingHistory()
+    history.add_player("a", ["TOP"], env.create_rating())
+    matches, mu, sigma = history.series("a", "TOP")
+    history.append("a", "TOP", 0, env.create_rating(mu=30))
+    history.extend([("a", "TOP")], 1, [31.0], [5.0])
+    assert matches.tolist() == [-1]
+    assert history.series("a", "TOP")[1].tolist() == [mu[0], 30.0, 31.0]
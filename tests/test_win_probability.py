@@ -0,0 +1,44 @@
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+import trueskill
+
+from teambalancer.rating import batch_cdf, win_probability, win_probability_batch
+
+
+def default_env():
+    return trueskill.TrueSkill()
+
+
+def normal_dist_env():
+    # 既定以外のバックエンド (batch_cdf は env.cdf を np.vectorize して使う)
+    normal = NormalDist()
+    return trueskill.TrueSkill(backend=(normal.cdf, normal.pdf, normal.inv_cdf))
+
+
+@pytest.mark.parametrize("make_env", [default_env, normal_dist_env])
+@pytest.mark.parametrize("sizes", [(5, 5), (1, 1), (3, 2)])
+def test_batch_matches_scalar(make_env, sizes):
+    env = make_env()
+    rng = np.random.default_rng(0)
+    mu1 = rng.normal(env.mu, 10, (200, sizes[0]))
+    mu2 = rng.normal(env.mu, 10, (200, sizes[1]))
+    sigma1 = rng.uniform(0.5, env.sigma, (200, sizes[0]))
+    sigma2 = rng.uniform(0.5, env.sigma, (200, sizes[1]))
+    expected = [
+        win_probability(
+            [trueskill.Rating(m, s) for m, s in zip(mu1[i], sigma1[i])],
+            [trueskill.Rating(m, s) for m, s in zip(mu2[i], sigma2[i])],
+            env,
+        )
+        for i in range(200)
+    ]
+    actual = win_probability_batch(mu1, sigma1, mu2, sigma2, env)
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+def test_non_default_backend_uses_env_cdf():
+    env = normal_dist_env()
+    x = np.linspace(-4, 4, 9)
+    np.testing.assert_array_equal(batch_cdf(env)(x), [env.cdf(v) for v in x])